@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+
+import numpy as np
+
+
+def source_key(paths_to_sources):
+    "create the cache key (path, size, mtime) for the given source files or directories"
+    key = []
+    for path in paths_to_sources:
+        stat = os.stat(path)
+        key.append([path, stat.st_size, stat.st_mtime])
+    return key
+
+
+def _path_to_key_file(path_to_cache_dir, name):
+    return os.path.join(path_to_cache_dir, name + ".key.json")
+
+
+def _path_to_array_file(path_to_cache_dir, name, array_name):
+    return os.path.join(path_to_cache_dir, name + "." + array_name + ".npy")
+
+
+def load(path_to_cache_dir, name, paths_to_sources, version=0):
+    "return the memory mapped arrays stored under name or None if missing, stale or of another version"
+    path_to_key_file = _path_to_key_file(path_to_cache_dir, name)
+    if not os.path.isfile(path_to_key_file):
+        return None
+
+    with open(path_to_key_file) as _:
+        stored = json.load(_)
+    if stored.get("version", 0) != version or stored["sources"] != source_key(paths_to_sources):
+        return None
+
+    arrays = {}
+    for array_name in stored["arrays"]:
+        path_to_array_file = _path_to_array_file(path_to_cache_dir, name, array_name)
+        if not os.path.isfile(path_to_array_file):
+            return None
+        arrays[array_name] = np.load(path_to_array_file, mmap_mode="r")
+    return arrays
+
+
+def store(path_to_cache_dir, name, paths_to_sources, arrays, version=0):
+    "store arrays under name, the key file is written last and thus marks a complete entry"
+    if not os.path.isdir(path_to_cache_dir):
+        try:
+            os.makedirs(path_to_cache_dir)
+        except OSError:
+            # created by another thread storing at the same time
+            if not os.path.isdir(path_to_cache_dir):
+                raise
+
+    path_to_key_file = _path_to_key_file(path_to_cache_dir, name)
+    if os.path.isfile(path_to_key_file):
+        os.remove(path_to_key_file)
+
+    for array_name, array in arrays.iteritems():
+        np.save(_path_to_array_file(path_to_cache_dir, name, array_name), array)
+
+    with open(path_to_key_file, "w") as _:
+        json.dump({
+            "version": version,
+            "sources": source_key(paths_to_sources),
+            "arrays": sorted(arrays.keys())
+        }, _)
+
+
+def load_or_create(path_to_cache_dir, name, paths_to_sources, create_arrays, version=0):
+    """return the arrays stored under name, if the sources (or the version of the arrays' layout)
+    changed since they were stored call create_arrays() and store its result first"""
+    arrays = load(path_to_cache_dir, name, paths_to_sources, version)
+    if arrays is None:
+        store(path_to_cache_dir, name, paths_to_sources, create_arrays(), version)
+        arrays = load(path_to_cache_dir, name, paths_to_sources, version)
+    return arrays
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+
+def climate_csv_filename(scenario, lat, lon):
+    "return the name of the climate csv file of a cell, e.g. baseline_3.25_33.25.csv"
+    return scenario + "_" + str(lat) + "_" + str(lon) + ".csv"
+
+
+def _parse_date(iso_date):
+    return datetime.strptime(iso_date, "%Y-%m-%d").date()
+
+
+def read_climate_csv(path_to_csv, header_lines=2, separator=","):
+    "return (header lines, iso dates, days x variables float32 array) of a climate csv file"
+    with open(path_to_csv) as _:
+        lines = _.read().splitlines()
+    header = [line.split(separator) for line in lines[:header_lines]]
+    rows = [line.split(separator) for line in lines[header_lines:] if line]
+    dates = [row[0] for row in rows]
+    values = np.array([row[1:] for row in rows], dtype=np.float32).reshape(len(rows), len(header[0]) - 1)
+    return header, dates, values
+
+
+def _path_to_cube_file(path_to_cube_dir, scenario, part):
+    return os.path.join(path_to_cube_dir, scenario + "." + part)
+
+
+def pack(path_to_scenario_dir, scenario, path_to_cube_dir, header_lines=2, separator=","):
+    """pack the daily climate csv files of all cells of a scenario into a single cells x days x variables
+    float32 array (<scenario>.cube.npy), the cells' (lat, lon) (<scenario>.cells.npy)
+    and the header lines, first date and number of days (<scenario>.meta.json),
+    all files have to cover the same consecutive days"""
+    cells = []
+    for filename in sorted(os.listdir(path_to_scenario_dir)):
+        #parse from "baseline_3.25_33.25.csv"
+        parts = filename.split("_")
+        if filename.endswith(".csv") and len(parts) == 3:
+            cells.append((float(parts[1]), float(parts[2][:-4]), filename))
+    if not cells:
+        raise Exception("no climate csv files in " + path_to_scenario_dir)
+
+    if not os.path.isdir(path_to_cube_dir):
+        os.makedirs(path_to_cube_dir)
+    path_to_meta = _path_to_cube_file(path_to_cube_dir, scenario, "meta.json")
+    # the meta file is written last and marks a complete cube
+    if os.path.isfile(path_to_meta):
+        os.remove(path_to_meta)
+
+    cube = None
+    for cell_index, (lat, lon, filename) in enumerate(cells):
+        header, dates, values = read_climate_csv(path_to_scenario_dir + filename, header_lines, separator)
+        if cube is None:
+            first_date = _parse_date(dates[0])
+            expected_dates = [(first_date + timedelta(days=day)).isoformat() for day in range(len(dates))]
+            cube = np.lib.format.open_memmap(_path_to_cube_file(path_to_cube_dir, scenario, "cube.npy"), mode="w+",
+                                             dtype=np.float32, shape=(len(cells), len(dates), values.shape[1]))
+            # decoded as latin-1 the header lines are restored byte by byte, whatever their encoding
+            meta = {"header": [[field.decode("latin-1") for field in line] for line in header],
+                    "start-date": dates[0], "days": len(dates), "separator": separator}
+        if dates != expected_dates or values.shape != cube.shape[1:]:
+            raise Exception(filename + " doesn't cover the same days or variables as " + cells[0][2])
+        cube[cell_index] = values
+
+    cube.flush()
+    del cube
+    np.save(_path_to_cube_file(path_to_cube_dir, scenario, "cells.npy"),
+            np.array([(lat, lon) for lat, lon, _ in cells], dtype=np.float64))
+    with open(path_to_meta, "w") as _:
+        json.dump(meta, _)
+    return len(cells)
+
+
+class ClimateCube(object):
+    "the memory mapped climate data of a scenario packed by pack"
+
+    def __init__(self, path_to_cube_dir, scenario):
+        with open(_path_to_cube_file(path_to_cube_dir, scenario, "meta.json")) as _:
+            meta = json.load(_)
+        self.scenario = scenario
+        self.header = [[field.encode("latin-1") for field in line] for line in meta["header"]]
+        self.separator = str(meta["separator"])
+        self.start_date = _parse_date(meta["start-date"])
+        self.days = meta["days"]
+        self.cube = np.load(_path_to_cube_file(path_to_cube_dir, scenario, "cube.npy"), mmap_mode="r")
+        cells = np.load(_path_to_cube_file(path_to_cube_dir, scenario, "cells.npy"))
+        self._cell_to_index = {(lat, lon): cell_index for cell_index, (lat, lon) in enumerate(cells.tolist())}
+
+    def cells(self):
+        return sorted(self._cell_to_index.keys())
+
+    def day_range(self, start_date=None, end_date=None):
+        """return the (first, last + 1) day indices of the days from start_date to end_date (iso dates or None),
+        outside of 0 ... days if the cube doesn't cover them"""
+        first = 0 if start_date is None else (_parse_date(start_date) - self.start_date).days
+        end = self.days if end_date is None else (_parse_date(end_date) - self.start_date).days + 1
+        return first, max(first, end)
+
+    def values(self, lat, lon, start_date=None, end_date=None):
+        """return the days x variables array of the cell (lat, lon) from start_date to end_date,
+        raise a ValueError if the cube doesn't cover all of these days"""
+        first, end = self.day_range(start_date, end_date)
+        if first < 0 or end > self.days:
+            last_date = date.fromordinal(self.start_date.toordinal() + self.days - 1)
+            raise ValueError("the " + self.scenario + " climate of cell (" + str(lat) + ", " + str(lon) + ") from " \
+            + str(start_date or self.start_date) + " to " + str(end_date or last_date) \
+            + " isn't covered by the climate cube, which covers " + self.start_date.isoformat() + " to " \
+            + last_date.isoformat())
+        return self.cube[self._cell_to_index[(lat, lon)], first:end]
+
+    def csv(self, lat, lon, start_date=None, end_date=None):
+        "return the climate csv (with header lines) of the cell (lat, lon) from start_date to end_date (see values)"
+        values = self.values(lat, lon, start_date, end_date)
+        day = date.fromordinal(self.start_date.toordinal() + self.day_range(start_date, end_date)[0])
+        one_day = timedelta(days=1)
+        lines = [self.separator.join(header_line) for header_line in self.header]
+        for row in values:
+            lines.append(day.isoformat() + self.separator + self.separator.join(map(str, row)))
+            day += one_day
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import sys
+import time
+
+import climate_cube
+
+
+def main():
+    """action=pack: pack the per cell climate csv files of each scenario into a climate cube,
+    action=unpack: write the csv files of each scenario's cube to a node local dir (the producer's climate=node-cache)"""
+
+    config = {
+        "action": "pack",
+        "path-to-climate-dir": "/archiv-daten/md/data/ethiopia/climate/ipsl-cm5a-lr/",
+        "path-to-cube-dir": "climate-cubes/",
+        "path-to-node-cache": "/tmp/ethiopia-climate/",
+        "scenarios": "baseline,rcp2p6,rcp4p5,rcp6p0,rcp8p5"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    for scenario in config["scenarios"].split(","):
+        start = time.time()
+        if config["action"] == "pack":
+            cell_count = climate_cube.pack(config["path-to-climate-dir"] + scenario + "/", scenario,
+                                           config["path-to-cube-dir"])
+            print "packed", cell_count, "cells of", scenario, "in", time.time() - start, "seconds"
+
+        elif config["action"] == "unpack":
+            cube = climate_cube.ClimateCube(config["path-to-cube-dir"], scenario)
+            path_to_scenario_dir = config["path-to-node-cache"] + scenario + "/"
+            if not os.path.isdir(path_to_scenario_dir):
+                os.makedirs(path_to_scenario_dir)
+            for lat, lon in cube.cells():
+                path_to_csv = path_to_scenario_dir + climate_cube.climate_csv_filename(scenario, lat, lon)
+                # write to a temporary file first, so that MONICA never reads a partial file
+                with open(path_to_csv + ".tmp", "wb") as _:
+                    _.write(cube.csv(lat, lon))
+                os.rename(path_to_csv + ".tmp", path_to_csv)
+            print "unpacked", len(cube.cells()), "cells of", scenario, "in", time.time() - start, "seconds"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import math
+import os
+import random
+import sys
+
+# the scenarios of the climate data and onset dates
+SCENARIOS = ["baseline", "rcp2p6", "rcp4p5", "rcp6p0", "rcp8p5"]
+
+# a grid in the ethiopian highlands, the soil data resolution and the climate data resolution
+START_LAT = 7.0
+START_LON = 37.0
+SOIL_RESOLUTION = 0.125
+CLIMATE_RESOLUTION = 0.5
+
+
+def main():
+    "create an archive with the layout and file formats of the ethiopia archive, filled with random data"
+
+    config = {
+        "path-to-archive": "bench/archive/",
+        "sites": "400", # number of soil profiles, about 60% of them are crop land
+        "layers": "3", # soil layers per profile
+        "seed": "1"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    path_to_archive = config["path-to-archive"]
+    random.seed(int(config["seed"]))
+    side = int(math.ceil(math.sqrt(int(config["sites"]))))
+    cells = [(START_LAT + SOIL_RESOLUTION * i, START_LON + SOIL_RESOLUTION * j)
+             for i in range(side) for j in range(side)][:int(config["sites"])]
+
+    for path in ["soil/", "slope/", "elevation/", "onset-dates/"] \
+    + ["climate/ipsl-cm5a-lr/" + scenario + "/" for scenario in SCENARIOS]:
+        if not os.path.isdir(path_to_archive + path):
+            os.makedirs(path_to_archive + path)
+
+    with open(path_to_archive + "Ethiopia_crop_land_prob.csv", "wb") as _:
+        writer = csv.writer(_)
+        writer.writerow(["OID", "ID", "x", "y", "count", "lon", "lat", "prob"])
+        for i, (lat, lon) in enumerate(cells):
+            writer.writerow([i, i, 0, 0, 1, lon + 0.01, lat + 0.01, random.randint(0, 100)])
+
+    with open(path_to_archive + "soil/soil.csv", "wb") as _:
+        writer = csv.writer(_)
+        writer.writerow(["lat", "lon", "Thickness", "Sand", "Clay", "pH", "FC", "PWP", "BD", "SOC"])
+        for lat, lon in cells:
+            for _layer in range(int(config["layers"])):
+                writer.writerow([lat, lon, 0.3, random.randint(20, 60), random.randint(10, 40),
+                                 round(random.uniform(5.5, 7.5), 1), round(random.uniform(0.25, 0.4), 2),
+                                 round(random.uniform(0.1, 0.2), 2), round(random.uniform(1.2, 1.6), 2),
+                                 round(random.uniform(0.5, 2.0), 2)])
+
+    # slope and elevation on a slightly shifted grid, like the real data
+    for name, create_value in [("slope", lambda: random.randint(0, 15)),
+                               ("elevation", lambda: random.randint(1200, 2600))]:
+        with open(path_to_archive + name + "/" + name + ".csv", "wb") as _:
+            writer = csv.writer(_)
+            writer.writerow(["lon", "lat", name])
+            for lat, lon in cells:
+                writer.writerow([lon - 0.02, lat - 0.02, create_value()])
+
+    climate_cells = sorted(set((math.floor(lat / CLIMATE_RESOLUTION) * CLIMATE_RESOLUTION + CLIMATE_RESOLUTION / 2,
+                                math.floor(lon / CLIMATE_RESOLUTION) * CLIMATE_RESOLUTION + CLIMATE_RESOLUTION / 2)
+                               for lat, lon in cells))
+    for scenario in SCENARIOS:
+        # only the file names are read by the producer, the content is a short header and a few days
+        for clat, clon in climate_cells:
+            with open(path_to_archive + "climate/ipsl-cm5a-lr/" + scenario + "/" + scenario + "_"
+                      + str(clat) + "_" + str(clon) + ".csv", "wb") as _:
+                writer = csv.writer(_)
+                writer.writerow(["iso-date", "tmin", "tavg", "tmax", "precip", "globrad", "relhumid", "wind"])
+                writer.writerow(["[]", "[°C]", "[°C]", "[°C]", "[mm]", "[MJ m-2]", "[%]", "[m s-1]"])
+                for day in range(1, 11):
+                    writer.writerow(["2011-01-" + str(day).zfill(2), 10, 18, 26, 0, 20, 50, 2])
+
+        with open(path_to_archive + "onset-dates/" + scenario + ".csv", "wb") as _:
+            writer = csv.writer(_)
+            writer.writerow(["year", "doy", "onset", "cell"])
+            for clat, clon in climate_cells:
+                for year in range(1971, 2100):
+                    writer.writerow([year, random.randint(120, 200), 1, "ons _ " + str(clat) + " _ " + str(clon)])
+
+    print "created archive with", len(cells), "soil profiles and", len(climate_cells), "climate cells in", path_to_archive
+
+
+if __name__ == "__main__":
+    main()
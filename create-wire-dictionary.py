@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import sys
+
+import zmq
+
+import spool_io
+import wire_format
+
+
+def main():
+    """build a dictionary for the compressed wire format from sample messages,
+    taken from spool files written by flush-queue.py (e.g. results) or received on port (e.g. the producer's envs),
+    use one dictionary for the envs and one for the results"""
+
+    config = {
+        "spools": "", # comma separated spool files
+        "port": "", # receive the samples on this port, e.g. run the producer with server=localhost port=<port>
+        "samples": "200",
+        "codec": "zlib",
+        "size": "", # bytes, default 32768 for zlib and 112640 for zstd
+        "path-to-dictionary": "wire-dictionaries/envs.dict"
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    sample_count = int(config["samples"])
+    samples = []
+    for path_to_spool in config["spools"].split(","):
+        if path_to_spool:
+            for msg in spool_io.read_frames(path_to_spool):
+                if len(samples) == sample_count:
+                    break
+                samples.append(wire_format.decode(msg))
+
+    if config["port"]:
+        context = zmq.Context()
+        socket = context.socket(zmq.PULL)
+        socket.bind("tcp://*:" + config["port"])
+        print "waiting for", sample_count - len(samples), "samples on port", config["port"]
+        while len(samples) < sample_count:
+            samples.append(wire_format.decode(socket.recv()))
+        socket.close(linger=0)
+
+    if not samples:
+        print "no samples, give spools or port"
+        return
+
+    if config["codec"] == "zstd":
+        if wire_format.zstandard is None:
+            raise Exception("the zstd codec needs the zstandard package")
+        size = int(config["size"]) if config["size"] else 112640
+        dictionary = wire_format.zstandard.train_dictionary(size, samples).as_bytes()
+    else:
+        # zlib finds the strings closest to the end of the dictionary first, so the most recent samples are last
+        size = int(config["size"]) if config["size"] else wire_format.ZLIB_WINDOW
+        dictionary = "".join(samples)[-size:]
+
+    path_to_dir = os.path.dirname(config["path-to-dictionary"])
+    if path_to_dir and not os.path.isdir(path_to_dir):
+        os.makedirs(path_to_dir)
+    with open(config["path-to-dictionary"], "wb") as _:
+        _.write(dictionary)
+
+    plain_size = sum(len(sample) for sample in samples)
+    wire = wire_format.WireFormat(config["codec"], dictionary=dictionary)
+    compressed_size = sum(len(wire.encode(sample)) for sample in samples)
+    print "wrote", len(dictionary), "bytes dictionary", wire_format.dictionary_id(dictionary), "to", \
+    config["path-to-dictionary"] + ", compresses the", len(samples), "samples by", round(plain_size / float(compressed_size), 1)
+
+
+if __name__ == "__main__":
+    main()
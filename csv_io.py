@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import time
+import warnings
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+
+def _parse_numeric(body, row_count, field_count, delimiter):
+    "return the rows x fields float64 array of an all numeric body, None if any field isn't a number"
+    with warnings.catch_warnings():
+        # numpy warns about the first field it can't parse and stops there
+        warnings.simplefilter("ignore", DeprecationWarning)
+        values = np.fromstring(body.replace("\n", delimiter), sep=delimiter)
+    if len(values) != row_count * field_count:
+        return None
+    return values.reshape(row_count, field_count)
+
+
+def parse_columns(text, columns, dtype=np.float64, delimiter=",", header_lines=1, extra_delimiters=()):
+    """parse the columns (field indices) of all rows of the csv text into one array each, of dtype or dtype[i],
+    extra_delimiters are split at like delimiter (e.g. " _ " in "ons _ 8.25 _ 37.25"),
+    the rows are parsed all at once as long as they have the same number of fields and nothing is quoted"""
+    dtypes = list(dtype) if isinstance(dtype, (list, tuple)) else [dtype] * len(columns)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n")
+    for extra_delimiter in extra_delimiters:
+        text = text.replace(extra_delimiter, delimiter)
+    start = 0
+    for _ in range(header_lines):
+        start = text.find("\n", start) + 1
+        if start == 0:
+            start = len(text)
+            break
+    body = text[start:].rstrip("\n")
+    if not body:
+        return [np.empty(0, dtype=column_dtype) for column_dtype in dtypes]
+
+    lines = body.split("\n")
+    delimiter_counts = set(line.count(delimiter) for line in lines)
+    if '"' not in body and len(delimiter_counts) == 1:
+        field_count = delimiter_counts.pop() + 1
+        numbers = _parse_numeric(body, len(lines), field_count, delimiter)
+        if numbers is not None and all(np.issubdtype(column_dtype, np.floating) for column_dtype in dtypes):
+            return [numbers[:, column].astype(column_dtype) for column, column_dtype in zip(columns, dtypes)]
+        fields = np.array(body.replace("\n", delimiter).split(delimiter)).reshape(len(lines), field_count)
+        values = [fields[:, column] for column in columns]
+    else:
+        rows = [row for row in csv.reader(lines, delimiter=delimiter) if row]
+        values = [np.array([row[column] for row in rows]) for column in columns]
+    return [column_values.astype(column_dtype) for column_values, column_dtype in zip(values, dtypes)]
+
+
+def read_columns(path_to_csv, columns, dtype=np.float64, delimiter=",", header_lines=1, extra_delimiters=()):
+    "read the columns of a csv file into arrays, see parse_columns"
+    # one read of the whole file, not line by line, matters most on a network mount
+    with open(path_to_csv, "rb") as _:
+        text = _.read()
+    try:
+        return parse_columns(text, columns, dtype, delimiter, header_lines, extra_delimiters)
+    except (ValueError, IndexError) as e:
+        raise ValueError(path_to_csv + ": " + str(e))
+
+
+def load_concurrently(loads, threads=4, metrics=None):
+    """call the functions of the dict loads (name -> function) on threads threads,
+    return {name: result}, print the seconds each took and add them as stage load-<name> to metrics"""
+    def load(name):
+        start = time.time()
+        return loads[name](), time.time() - start
+
+    names = list(loads)
+    pool = ThreadPool(max(1, min(threads, len(names))))
+    try:
+        loaded = pool.map(load, names)
+    finally:
+        pool.close()
+        pool.join()
+
+    results = {}
+    for name, (result, seconds) in zip(names, loaded):
+        results[name] = result
+        print "loaded", name, "in", round(seconds, 3), "seconds"
+        if metrics:
+            metrics.add_stage_time("load-" + name, seconds)
+    return results
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import copy
+import json
+import re
+from itertools import izip
+
+_PLACEHOLDER_RE = re.compile(r'"@@([^@"]+)@@"')
+
+
+def placeholder(name):
+    "return the marker to put into a structure where the value for name will be spliced in"
+    return "@@" + name + "@@"
+
+
+def dumps(obj):
+    "encode obj compactly, the same way zmq's send_json does"
+    return json.dumps(obj, separators=(",", ":"))
+
+
+class Encoded(str):
+    "an already JSON encoded value, spliced into a template as is"
+    pass
+
+
+class JsonTemplate(object):
+    "the JSON encoding of a structure containing placeholders, which is encoded only once"
+
+    def __init__(self, obj):
+        parts = _PLACEHOLDER_RE.split(dumps(obj))
+        self._fragments = parts[0::2]
+        self.names = parts[1::2]
+
+    def encode(self, values):
+        "return the JSON encoding with the placeholders replaced by the (encoded) values"
+        out = [self._fragments[0]]
+        for name, fragment in izip(self.names, self._fragments[1:]):
+            value = values[name]
+            out.append(value if isinstance(value, Encoded) else dumps(value))
+            out.append(fragment)
+        return "".join(out)
+
+
+class EnvBuilder(object):
+    """builds encoded envs from a pre-encoded base env, splicing in only the per site/job fields:
+    soil-profile, latitude, slope, height, crop-rotation, csv-options, path-to-climate-csv and custom-id,
+    with inline_climate also climate-csv, the climate data sent within the env"""
+
+    def __init__(self, env, inline_climate=False):
+        env = copy.deepcopy(env)
+        site_params = env["params"]["siteParameters"]
+        site_params["SoilProfileParameters"] = placeholder("soil-profile")
+        site_params["Latitude"] = placeholder("latitude")
+        site_params["Slope"] = placeholder("slope")
+        site_params["HeightNN"] = placeholder("height")
+        env["cropRotation"] = placeholder("crop-rotation")
+        env["csvViaHeaderOptions"] = placeholder("csv-options")
+        env["pathToClimateCSV"] = placeholder("path-to-climate-csv")
+        if inline_climate:
+            env["climateCSV"] = placeholder("climate-csv")
+        env["customId"] = placeholder("custom-id")
+        self._env = JsonTemplate(env)
+        self._templates = {}
+
+    def template(self, key, create_structure):
+        "return the JsonTemplate stored under key, create_structure() is called and encoded only the first time"
+        template = self._templates.get(key)
+        if template is None:
+            template = self._templates[key] = JsonTemplate(create_structure())
+        return template
+
+    def build(self, values):
+        "return the encoded env for the given per job values"
+        return self._env.encode(values)
+
+
+def encode_list(encoded_items):
+    "return the encoding of a list of already encoded items"
+    return Encoded("[" + ",".join(encoded_items) + "]")
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+# Tommaso Stella <tommaso.stella@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import os
+import sys
+
+import output_writers
+
+
+def main():
+    "export the consumer's columnar result store to csv files in the consumer's csv layout"
+
+    config = {
+        "path-to-store": "out/columns/",
+        "path-to-csv-dir": "out/csv/",
+        "scenarios": "", # comma separated scenario names, default all
+        "lat": "",
+        "lon": "",
+        "from-year": "",
+        "to-year": ""
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v 
+
+    def optional_float(key):
+        return float(config[key]) if len(config[key]) > 0 else None
+
+    names = config["scenarios"].split(",") if len(config["scenarios"]) > 0 \
+    else output_writers.list_partitions(config["path-to-store"])
+
+    if not os.path.isdir(config["path-to-csv-dir"]):
+        os.makedirs(config["path-to-csv-dir"])
+
+    for name in names:
+        rows = output_writers.read_partition(config["path-to-store"], name,
+                                             lat=optional_float("lat"), lon=optional_float("lon"),
+                                             from_year=optional_float("from-year"), to_year=optional_float("to-year"))
+
+        with open(config["path-to-csv-dir"] + name + ".csv", "wb") as _:
+            _.write(output_writers.CSV_HEADER)
+            writer = csv.writer(_, delimiter=",")
+            columns = [rows[column] for column in output_writers.COLUMNS]
+            for row in zip(*columns):
+                writer.writerow([output_writers.format_value(column, value) 
+                                 for column, value in zip(output_writers.COLUMNS, row)])
+
+        print "exported", len(rows), "rows of", name
+
+
+if __name__ == "__main__":
+    main()
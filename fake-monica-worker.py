@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import random
+import sys
+import time
+import zlib
+
+import zmq
+
+import run_metrics
+
+# (min, max, type) of the synthetic values by MONICA output name
+VALUE_RANGES = {
+    "DOY": (1, 365, int),
+    "Stage": (1, 7, int),
+    "Count": (80, 160, int),
+    "Yield": (0.0, 8000.0, float),
+    "AbBiom": (0.0, 15000.0, float),
+    "LAI": (0.0, 6.0, float),
+    "NFert": (0.0, 100.0, float),
+    "NLeach": (0.0, 20.0, float),
+    "SumNUp": (0.0, 200.0, float),
+    "Precip": (200.0, 1500.0, float),
+    "Tra": (100.0, 500.0, float),
+    "Act_ET": (200.0, 800.0, float),
+    "Tavg": (15.0, 30.0, float)
+}
+
+
+def parse_output_id(output):
+    "return (name, display name, aggregation) of an output spec like \"DOY|sow-doy\" or [\"Yield\", \"LAST\"]"
+    if isinstance(output, list):
+        name, aggregation = output[0], output[1] if len(output) > 1 else ""
+    else:
+        name, aggregation = output, ""
+    name, _, display_name = name.partition("|")
+    return name, display_name, aggregation
+
+
+def create_result(env, delay=0.0):
+    """create a work result for env shaped like MONICA's, with one data section per section of the env's "events"
+    and one value per year between the csvViaHeaderOptions start and end date,
+    the values are random but the same for the same customId"""
+    rand = random.Random(zlib.crc32(env["customId"]))
+    options = env["csvViaHeaderOptions"]
+    years = range(int(options["start-date"][:4]), int(options["end-date"][:4]) + 1)
+
+    data = []
+    events = env.get("events", [])
+    for spec, outputs in zip(events[0::2], events[1::2]):
+        output_ids = []
+        results = []
+        for i, output in enumerate(outputs):
+            name, display_name, aggregation = parse_output_id(output)
+            output_ids.append({
+                "id": i,
+                "name": name,
+                "displayName": display_name,
+                "unit": "",
+                "jsonInput": json.dumps(output),
+                "aggregation": aggregation,
+                "timeAggregation": aggregation,
+                "organ": "",
+                "fromLayer": -1,
+                "toLayer": -1,
+                "layerAggOp": ""
+            })
+            if name == "Year":
+                results.append(list(years))
+            else:
+                low, high, type_ = VALUE_RANGES.get(name, (0.0, 1.0, float))
+                if type_ is int:
+                    results.append([rand.randint(low, high) for _ in years])
+                else:
+                    results.append([rand.uniform(low, high) for _ in years])
+        data.append({"origSpec": json.dumps(spec), "outputIds": output_ids, "results": results})
+
+    if delay > 0:
+        time.sleep(delay)
+    return {"type": "result", "customId": env["customId"], "data": data, "errors": [], "warnings": []}
+
+
+def main():
+    "stand in for the MONICA workers: receive the producer's envs and send synthetic results to the consumer"
+
+    config = {
+        "producer-port": "6666",
+        "consumer-port": "7777",
+        "delay": "0", # seconds of simulated computation per env
+        "drop-rate": "0" # lose this fraction of the envs without a result, like a crashed worker
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    delay = float(config["delay"])
+    drop_rate = float(config["drop-rate"])
+    dropped = 0
+
+    context = zmq.Context()
+    envs_socket = context.socket(zmq.PULL)
+    envs_socket.bind("tcp://*:" + config["producer-port"])
+    results_socket = context.socket(zmq.PUSH)
+    results_socket.bind("tcp://*:" + config["consumer-port"])
+
+    metrics = run_metrics.RunMetrics("simulated")
+    try:
+        while True:
+            env = json.loads(envs_socket.recv(), encoding="latin-1")
+            if drop_rate > 0 and random.random() < drop_rate:
+                dropped += 1
+                continue
+            result = json.dumps(create_result(env, delay), separators=(",", ":"))
+            results_socket.send(result)
+            metrics.count_message(len(result))
+    except KeyboardInterrupt:
+        pass
+
+    metrics.report()
+    if dropped > 0:
+        print "dropped", dropped, "envs"
+
+
+if __name__ == "__main__":
+    main()
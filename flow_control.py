@@ -0,0 +1,210 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import zmq
+
+
+class AckPublisher(object):
+    """publishes the ids of the jobs whose results the consumer has written to the producers,
+    in batches of at most max_batch ids or after at most max_delay seconds"""
+
+    def __init__(self, context, port, max_batch=100, max_delay=0.2):
+        self._socket = context.socket(zmq.PUB)
+        self._socket.bind("tcp://*:" + str(port))
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pending = []
+        self._last_flush = time.time()
+
+    def ack(self, job_id):
+        self._pending.append(job_id)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if len(self._pending) >= self.max_batch or time.time() - self._last_flush >= self.max_delay:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._socket.send(json.dumps(self._pending))
+            del self._pending[:]
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self._socket.close()
+
+
+class FlowControl(object):
+    """lets the producer send only if less than max_in_flight of its jobs are unacknowledged by the consumer
+    (if connected to the consumer's ack publisher at ack_server) and not faster than max_rate envs per second,
+    0 means no limit,
+    with redispatch_factor > 0 (and ack_server) jobs unacknowledged for longer than their deadline are sent again
+    by resend(env), at most max_redispatches times, the deadline being redispatch_factor times the 95th percentile
+    of the acknowledgement latencies observed so far, but at least min_deadline seconds,
+    the envs in flight are kept for that, so max_in_flight should be set too,
+    without redispatching jobs unacknowledged for longer than ack_timeout seconds are given up instead,
+    so jobs whose results or acknowledgements were lost don't hold their slots forever,
+    jobs are only tracked while limiting or redispatching, otherwise they may just be queued behind a long backlog"""
+
+    def __init__(self, context, ack_server=None, max_in_flight=0, max_rate=0.0, ack_timeout=300.0,
+                 redispatch_factor=0.0, min_deadline=60.0, max_redispatches=2, resend=None,
+                 min_latencies=20, latency_window=1000):
+        self.max_in_flight = max_in_flight if ack_server else 0
+        self.max_rate = max_rate
+        self.ack_timeout = ack_timeout
+        self.redispatch_factor = redispatch_factor if ack_server and resend else 0.0
+        self.min_deadline = min_deadline
+        self.max_redispatches = max_redispatches
+        self.min_latencies = min_latencies
+        self._resend = resend
+        # job id -> time (re)sent, in the order of these times
+        self._in_flight = OrderedDict()
+        # job id -> env of the jobs in flight, if they might be redispatched
+        self._envs = {}
+        # of the most recently acknowledged jobs which were sent only once,
+        # the acknowledgement of a redispatched job can't be told apart from the one of its first dispatch
+        self._latencies = deque(maxlen=latency_window)
+        # job id -> times redispatched
+        self.redispatched = {}
+        # ids of the jobs given up after max_redispatches, unless acknowledged after all
+        self.lost = set()
+        self._next_check = time.time()
+        self._next_send = time.time()
+        self._last_ack = time.time()
+        self._socket = None
+        if ack_server and (self.max_in_flight > 0 or self.redispatch_factor > 0):
+            self._socket = context.socket(zmq.SUB)
+            self._socket.setsockopt(zmq.SUBSCRIBE, "")
+            self._socket.connect("tcp://" + ack_server)
+
+    def in_flight(self):
+        "number of jobs sent but not acknowledged yet"
+        return len(self._in_flight)
+
+    def _receive_acks(self, timeout_ms):
+        "remove the acknowledged jobs from the jobs in flight, waiting at most timeout_ms for the first acks"
+        while self._socket.poll(timeout_ms):
+            now = time.time()
+            for job_id in json.loads(self._socket.recv()):
+                # acks of the jobs of other shards and of the duplicates of redispatched jobs are ignored
+                sent_time = self._in_flight.pop(job_id, None)
+                if sent_time is not None:
+                    self._envs.pop(job_id, None)
+                    if job_id not in self.redispatched:
+                        self._latencies.append(now - sent_time)
+                self.lost.discard(job_id)
+            self._last_ack = now
+            timeout_ms = 0
+
+    def deadline(self):
+        "return the seconds after which an unacknowledged job is redispatched, None while too few latencies are known"
+        if len(self._latencies) < self.min_latencies:
+            return None
+        return max(self.min_deadline, self.redispatch_factor * np.percentile(self._latencies, 95))
+
+    def _handle_overdue(self):
+        """send the jobs unacknowledged for longer than the deadline again, without redispatching give up the ones
+        unacknowledged for longer than ack_timeout, checked at most once a second"""
+        now = time.time()
+        if now < self._next_check:
+            return
+        self._next_check = now + 1.0
+        deadline = self.deadline() if self.redispatch_factor > 0 else self.ack_timeout
+        if deadline is None:
+            return
+
+        overdue = []
+        for job_id, sent_time in self._in_flight.iteritems():
+            if now - sent_time < deadline:
+                break
+            overdue.append(job_id)
+        if not overdue:
+            return
+
+        if self.redispatch_factor <= 0:
+            for job_id in overdue:
+                del self._in_flight[job_id]
+                self.lost.add(job_id)
+            print "giving up on", len(overdue), "jobs unacknowledged for more than", self.ack_timeout, "seconds:", \
+            " ".join(map(str, overdue))
+            return
+
+        redispatched = []
+        for job_id in overdue:
+            del self._in_flight[job_id]
+            env = self._envs.pop(job_id)
+            if self.redispatched.get(job_id, 0) >= self.max_redispatches:
+                self.lost.add(job_id)
+                print "giving up on job", job_id, "after", self.max_redispatches, "redispatches"
+                continue
+            self.redispatched[job_id] = self.redispatched.get(job_id, 0) + 1
+            self._resend(env)
+            # the redispatched job's deadline starts anew
+            self._in_flight[job_id] = time.time()
+            self._envs[job_id] = env
+            redispatched.append(job_id)
+        if redispatched:
+            print "redispatched", len(redispatched), "jobs unacknowledged for more than", round(deadline, 1), \
+            "seconds:", " ".join(map(str, redispatched))
+
+    def wait_for_slot(self):
+        "block until the next env may be sent"
+        if self._socket:
+            self._receive_acks(0)
+            self._handle_overdue()
+            while len(self._in_flight) >= self.max_in_flight > 0:
+                self._receive_acks(1000)
+                self._handle_overdue()
+                if self._in_flight and time.time() - self._last_ack > self.ack_timeout:
+                    print "no acknowledgements for", self.ack_timeout, "seconds with", len(self._in_flight), \
+                    "jobs in flight, is the consumer running with ack-port?"
+                    self._last_ack = time.time()
+
+        if self.max_rate > 0:
+            now = time.time()
+            if self._next_send > now:
+                time.sleep(self._next_send - now)
+            self._next_send = max(now, self._next_send) + 1.0 / self.max_rate
+
+    def sent(self, job_id, env=None):
+        if self._socket:
+            self._in_flight[job_id] = time.time()
+            if self.redispatch_factor > 0:
+                self._envs[job_id] = env
+
+    def drain(self):
+        """if redispatching, block until all jobs sent are acknowledged or given up, redispatching the overdue ones,
+        at most until there were no acknowledgements for ack_timeout seconds"""
+        if self.redispatch_factor <= 0:
+            return
+        while self._in_flight:
+            self._receive_acks(1000)
+            self._handle_overdue()
+            if time.time() - self._last_ack > self.ack_timeout:
+                print "no acknowledgements for", self.ack_timeout, "seconds, not waiting for the", \
+                len(self._in_flight), "jobs still in flight"
+                break
+
+    def close(self):
+        if self._socket:
+            self._socket.close()
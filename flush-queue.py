@@ -17,19 +17,29 @@
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
 import sys
+import time
 #print sys.path
 
 import zmq
 #print "pyzmq version: ", zmq.pyzmq_version(), " zmq version: ", zmq.zmq_version()
 
+import run_metrics
+import spool_io
+import wire_format
+
 LOCAL_RUN = False
 
 def main():
-    "simply empty queue"
+    """empty the queue as fast as possible without decoding the messages,
+    optionally spooling them to a file, which the consumer can replay (run-work-consumer.py replay=<spool>)"""
 
     config = {
         "port": "7778",
-        "server": "cluster2"
+        "server": "cluster2",
+        "spool": "", # append the raw messages compressed to this file
+        "compress-level": "1", # zlib level of the spooled messages
+        "idle-timeout": "0", # > 0 stop after this many seconds without messages
+        "report-interval": "10"
     }
     if len(sys.argv) > 1:
         for arg in sys.argv[1:]:
@@ -44,11 +54,48 @@ def main():
     else:
         socket.connect("tcp://" + config["server"] + ":" + config["port"])
 
-    i = 0
-    while True:
-        socket.recv_json(encoding="latin-1")
-        if i%10 == 0:
-            print i,
-        i = i + 1
+    spool = spool_io.SpoolWriter(config["spool"], int(config["compress-level"])) if config["spool"] else None
+    metrics = run_metrics.RunMetrics("drained", report_interval=float(config["report-interval"]))
+    idle_timeout = float(config["idle-timeout"])
+    last_message = time.time()
+    compressed_count = 0
+    try:
+        while True:
+            if not socket.poll(1000):
+                if spool:
+                    spool.flush_if_due()
+                if idle_timeout > 0 and time.time() - last_message > idle_timeout:
+                    print "no messages for", idle_timeout, "seconds, queue is empty"
+                    break
+                continue
+
+            # take all queued messages before polling again
+            while True:
+                try:
+                    msg = socket.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                is_compressed = wire_format.is_compressed(msg)
+                if spool:
+                    # compressing the compressed wire format again is a waste of time
+                    spool.write(msg, compress_level=0 if is_compressed else None)
+                    # a queue that never runs empty never reaches the idle branch above
+                    spool.flush_if_due()
+                compressed_count += is_compressed
+                metrics.count_message(len(msg))
+            last_message = time.time()
+
+    except KeyboardInterrupt:
+        print "interrupted"
+
+    metrics.report()
+    if compressed_count > 0:
+        print compressed_count, "messages were in the compressed wire format"
+    if spool:
+        spool.close()
+        print "spooled", metrics.messages, "messages (" + str(round(metrics.bytes / 1e6, 1)) + " MB) as", \
+        round(spool.bytes / 1e6, 1), "MB to", config["spool"]
+    else:
+        print "drained", metrics.messages, "messages"
 
 main()
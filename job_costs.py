@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import os
+import time
+
+import numpy as np
+
+# a job's cost is modelled as coefficients . (1, simulated years, years with their own cultivation method)
+FEATURES = ["jobs", "years", "rotation-years"]
+
+# relative costs as long as there is no history: the simulated years dominate,
+# a crop rotation of a cultivation method per year (calculated-onsets) makes each year more expensive
+DEFAULT_COEFFICIENTS = np.array([0.0, 1.0, 0.5])
+
+
+def path_to_cost_history(path_to_out_dir):
+    return path_to_out_dir + "metrics/job-costs.csv"
+
+
+class CostRecorder(object):
+    """records for windows of about window seconds the seconds the window took and the summed features
+    of the jobs whose results arrived in it, appended to a csv across runs,
+    the cost model is fitted to these windows assuming the cluster was busy all the time"""
+
+    def __init__(self, path_to_history_csv, window=60.0, min_jobs=10):
+        path_to_dir = os.path.dirname(path_to_history_csv)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        is_new = not os.path.isfile(path_to_history_csv)
+        self._file = open(path_to_history_csv, "ab")
+        self._writer = csv.writer(self._file)
+        if is_new:
+            self._writer.writerow(["seconds"] + FEATURES)
+            # a producer started before the first window reads the history
+            self._file.flush()
+        self.window = window
+        self.min_jobs = min_jobs
+        self._start = time.time()
+        self._sums = np.zeros(len(FEATURES))
+        self._has_unknown = False
+
+    def add(self, years, rotation_years):
+        "add a job that simulated years, rotation_years of them with their own cultivation method"
+        self._sums += (1, years, rotation_years)
+        self._end_window_if_due()
+
+    def add_unknown(self):
+        """add a job whose features are unknown (e.g. missing in the manifest of an older producer),
+        the window's seconds can't be attributed to its features then, so the window isn't recorded"""
+        self._sums[0] += 1
+        self._has_unknown = True
+        self._end_window_if_due()
+
+    def _end_window_if_due(self):
+        now = time.time()
+        if now - self._start >= self.window:
+            # windows with only a few jobs are mostly waiting for the cluster
+            if self._sums[0] >= self.min_jobs and not self._has_unknown:
+                self._writer.writerow([round(now - self._start, 3)] + self._sums.tolist())
+                self._file.flush()
+            self._start = now
+            self._sums[:] = 0
+            self._has_unknown = False
+
+    def close(self):
+        self._file.close()
+
+
+def fit_coefficients(path_to_history_csv, min_windows=5):
+    """return the coefficients fitted by least squares to the recorded windows,
+    None if there are less than min_windows windows (e.g. an empty or header-only history) or the fit is useless"""
+    if not os.path.isfile(path_to_history_csv):
+        return None
+    with open(path_to_history_csv) as _:
+        reader = csv.reader(_)
+        # the header, missing in a history just created by a consumer
+        next(reader, None)
+        windows = np.array([map(float, line) for line in reader if len(line) == 1 + len(FEATURES)],
+                           dtype=np.float64).reshape(-1, 1 + len(FEATURES))
+    if len(windows) < min_windows:
+        return None
+    coefficients = np.linalg.lstsq(windows[:, 1:], windows[:, 0], rcond=-1)[0]
+    # negative costs are artifacts of too little variation between the windows
+    coefficients = np.maximum(coefficients, 0.0)
+    if not coefficients[1:].any():
+        return None
+    return coefficients
+
+
+def estimate(coefficients, years, rotation_years):
+    "return the estimated costs of jobs simulating years (arrays), rotation_years of them with their own cultivation method"
+    return coefficients[0] + coefficients[1] * np.asarray(years) + coefficients[2] * np.asarray(rotation_years)
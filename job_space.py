@@ -0,0 +1,150 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import heapq
+
+import numpy as np
+
+
+def parse_list(value):
+    "parse a comma separated config value, None (no filter) if empty"
+    return value.split(",") if len(value) > 0 else None
+
+
+def parse_bbox(bbox):
+    "parse 'min-lat,min-lon,max-lat,max-lon' into a tuple of floats"
+    values = map(float, bbox.split(","))
+    if len(values) != 4:
+        raise ValueError("bbox has to be min-lat,min-lon,max-lat,max-lon, not " + bbox)
+    return tuple(values)
+
+
+def read_polygon(path_to_polygon_csv):
+    "read the vertices of a polygon from a csv with a lat,lon header, as n x 2 (lat, lon) array"
+    with open(path_to_polygon_csv) as _:
+        reader = csv.reader(_)
+        header = [column.strip() for column in reader.next()]
+        lat_column = header.index("lat")
+        lon_column = header.index("lon")
+        vertices = [(float(line[lat_column]), float(line[lon_column])) for line in reader if line]
+    if len(vertices) < 3:
+        raise ValueError(path_to_polygon_csv + " has less than 3 vertices")
+    return np.array(vertices, dtype=np.float64)
+
+
+def is_in_bbox(lats, lons, bbox):
+    "return a mask of the points inside the bbox (min lat, min lon, max lat, max lon)"
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+
+
+def is_in_polygon(lats, lons, polygon):
+    "return a mask of the points inside the polygon (n x 2 (lat, lon) vertices), by counting ray crossings"
+    inside = np.zeros(len(lats), dtype=bool)
+    for (lat1, lon1), (lat2, lon2) in zip(polygon, np.roll(polygon, -1, axis=0)):
+        crosses = (lats < lat1) != (lats < lat2)
+        if lat1 != lat2:
+            crosses &= lons < lon1 + (lats - lat1) * (lon2 - lon1) / (lat2 - lat1)
+        inside ^= crosses
+    return inside
+
+
+def sample_sites(selected, strata, fraction, seed, stratified=False):
+    """return a mask of a sample of fraction of the selected sites, drawn with the random seed,
+    stratified: the same fraction of the selected sites of every stratum (e.g. elevation band), at least one each"""
+    random = np.random.RandomState(seed)
+    if not stratified:
+        return selected & (random.random_sample(len(selected)) < fraction)
+    sample = np.zeros(len(selected), dtype=bool)
+    for stratum in np.unique(strata[selected]):
+        site_indices = np.flatnonzero(selected & (strata == stratum))
+        count = max(1, int(round(fraction * len(site_indices))))
+        sample[random.choice(site_indices, count, replace=False)] = True
+    return sample
+
+
+class JobSpace(object):
+    """the jobs of all scenarios (rcp, adaptation option, variety) for all sites, narrowed by filters,
+    job ids are numbered over the whole space, so that they are the same whatever the filters"""
+
+    def __init__(self, rcps, adaptation_options, varieties, site_count):
+        self.scenarios = [(rcp, adaptation_option, variety)
+                          for rcp in rcps for adaptation_option in adaptation_options for variety in varieties]
+        self.site_count = site_count
+        self.selected_scenarios = range(len(self.scenarios))
+        self.selected_sites = np.ones(site_count, dtype=bool)
+
+    def filter_scenarios(self, rcps=None, sowings=None, fertilizers=None, cycle_lengths=None, varieties=None):
+        "keep only the scenarios with the given values, None keeps all"
+        def matches(values, value):
+            return values is None or value in values
+
+        self.selected_scenarios = [scenario_index for scenario_index in self.selected_scenarios
+                                   if matches(rcps, self.scenarios[scenario_index][0])
+                                   and matches(sowings, self.scenarios[scenario_index][1]["sowing"])
+                                   and matches(fertilizers, self.scenarios[scenario_index][1]["fertilizer"])
+                                   and matches(cycle_lengths, self.scenarios[scenario_index][1]["cycle-length"])
+                                   and matches(varieties, self.scenarios[scenario_index][2])]
+
+    def filter_sites(self, mask):
+        "keep only the sites where mask is True"
+        self.selected_sites &= mask
+
+    def count(self, shard=0, shard_count=1, sites=None):
+        """return the number of selected jobs {rcp: count} of the shard, without generating them,
+        if given only of the sites where sites is True"""
+        site_indices = np.flatnonzero(self.selected_sites if sites is None else self.selected_sites & sites)
+        counts = {}
+        for scenario_index in self.selected_scenarios:
+            rcp = self.scenarios[scenario_index][0]
+            counts[rcp] = counts.get(rcp, 0) \
+            + np.count_nonzero((scenario_index * self.site_count + site_indices) % shard_count == shard)
+        return counts
+
+    def jobs(self, shard=0, shard_count=1, costs=None):
+        """generate (job id, rcp, adaptation option, variety, site index) of the selected jobs of the shard,
+        scenario by scenario in the order of the rcps, adaptation options and varieties,
+        or if costs is given (returning the estimated costs of a scenario's jobs at an array of site indices)
+        the most expensive jobs first, jobs of the same cost taking turns between the scenarios"""
+        site_indices = np.flatnonzero(self.selected_sites)
+
+        def shard_sites(scenario_index):
+            # jobs belong to shard job_id % shard_count
+            return site_indices[(scenario_index * self.site_count + site_indices) % shard_count == shard]
+
+        if costs is None:
+            for scenario_index in self.selected_scenarios:
+                rcp, adaptation_option, variety = self.scenarios[scenario_index]
+                first_job_id = scenario_index * self.site_count
+                for site_index in shard_sites(scenario_index).tolist():
+                    yield first_job_id + site_index, rcp, adaptation_option, variety, site_index
+            return
+
+        def ranked_jobs(scenario_order, scenario_index):
+            sites = shard_sites(scenario_index)
+            scenario_costs = np.asarray(costs(scenario_index, sites), dtype=np.float64)
+            ranking = np.argsort(-scenario_costs, kind="mergesort")
+            for rank, (site_index, cost) in enumerate(zip(sites[ranking].tolist(), scenario_costs[ranking].tolist())):
+                # the rank lets the scenarios take turns for equal costs
+                yield -cost, rank, scenario_order, scenario_index, site_index
+
+        for _, _, _, scenario_index, site_index in heapq.merge(*[ranked_jobs(scenario_order, scenario_index)
+                                                                 for scenario_order, scenario_index
+                                                                 in enumerate(self.selected_scenarios)]):
+            rcp, adaptation_option, variety = self.scenarios[scenario_index]
+            yield scenario_index * self.site_count + site_index, rcp, adaptation_option, variety, site_index
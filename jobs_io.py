@@ -0,0 +1,470 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import json
+import os
+import re
+import time
+from fractions import gcd
+
+# the job id is appended as 9th field to the customId
+JOB_ID_FIELD = 8
+
+# the customId of a job simulated for several sites with identical inputs lists the other sites'
+# "lat,lon,elevation,job id" separated by ";" in this field
+DUPLICATES_FIELD = 9
+
+
+def job_id_from_custom_id(custom_id):
+    "return the job id in custom_id or None for customIds without job id"
+    ci_parts = custom_id.split("|")
+    if len(ci_parts) > JOB_ID_FIELD and len(ci_parts[JOB_ID_FIELD]) > 0:
+        return int(ci_parts[JOB_ID_FIELD])
+    return None
+
+
+def encode_duplicates(duplicates):
+    "return the customId field listing the (lat, lon, elevation, job id) of duplicate jobs"
+    return ";".join(",".join(map(str, duplicate)) for duplicate in duplicates)
+
+
+def duplicates_from_custom_id(custom_id):
+    "return the [(lat, lon, elevation, job id)] strings of the jobs whose results are the same as custom_id's"
+    ci_parts = custom_id.split("|")
+    if len(ci_parts) > DUPLICATES_FIELD and len(ci_parts[DUPLICATES_FIELD]) > 0:
+        return [tuple(duplicate.split(",")) for duplicate in ci_parts[DUPLICATES_FIELD].split(";")]
+    return []
+
+
+def path_to_manifest(path_to_out_dir, shard, shard_count):
+    "return the path to the manifest of the given shard"
+    return path_to_out_dir + "manifests/shard-" + str(shard) + "-of-" + str(shard_count) + ".csv"
+
+
+# a manifest is written to this path first and renamed when the producer (shard) has written all jobs
+PARTIAL_SUFFIX = ".part"
+
+_MANIFEST_NAME_RE = re.compile(r"^shard-(\d+)-of-(\d+)\.csv$")
+
+# the last field of a manifest's header names the run the manifest belongs to
+RUN_ID_PREFIX = "run-id:"
+
+# the field before it the hash of the run's job space
+JOB_SPACE_PREFIX = "job-space:"
+
+
+def manifest_header(run_id, job_space):
+    """return the header of a manifest of the run run_id of the job space with the hash job_space,
+    the fields after the customId are the job's cost features"""
+    return ["job-id", "customId", "years", "rotation-years", JOB_SPACE_PREFIX + job_space, RUN_ID_PREFIX + run_id]
+
+
+def read_manifest_header(path_to_manifest_csv):
+    "return the fields of the header of a manifest, None as long as it isn't completely written"
+    with open(path_to_manifest_csv, "rb") as _:
+        line = _.readline()
+    if not line.endswith("\n"):
+        return None
+    return next(csv.reader([line]), [])
+
+
+def read_manifest_run_id(path_to_manifest_csv):
+    "return the run id in the header of a manifest, None for a manifest without one"
+    header = read_manifest_header(path_to_manifest_csv)
+    if header and header[-1].startswith(RUN_ID_PREFIX):
+        return header[-1][len(RUN_ID_PREFIX):]
+    return None
+
+
+def list_manifests(path_to_out_dir, include_partial=False, run_id=None):
+    "return the filenames of the manifests in the output dir, if run_id is given only of its manifests"
+    path_to_manifests = path_to_out_dir + "manifests/"
+    if not os.path.isdir(path_to_manifests):
+        return []
+    filenames = []
+    for filename in sorted(os.listdir(path_to_manifests)):
+        if not (filename.endswith(".csv") or (include_partial and filename.endswith(".csv" + PARTIAL_SUFFIX))):
+            continue
+        try:
+            if run_id is None or read_manifest_run_id(path_to_manifests + filename) == run_id:
+                filenames.append(filename)
+        except (IOError, OSError):
+            # renamed (.part) or removed by a producer meanwhile
+            continue
+    return filenames
+
+
+def read_newest_run_id(path_to_out_dir):
+    "return the run id of the most recently changed manifest, unfinished ones included, None if there is none"
+    path_to_manifests = path_to_out_dir + "manifests/"
+    newest = None
+    for filename in list_manifests(path_to_out_dir, include_partial=True):
+        try:
+            mtime = os.path.getmtime(path_to_manifests + filename)
+            if newest is None or mtime > newest[0]:
+                newest = (mtime, read_manifest_run_id(path_to_manifests + filename))
+        except (IOError, OSError):
+            continue
+    return newest[1] if newest else None
+
+
+def manifests_changed_time(path_to_out_dir):
+    "return the time a manifest was last created, renamed or removed in the output dir, None without manifests"
+    try:
+        return os.stat(path_to_out_dir + "manifests/").st_mtime
+    except OSError:
+        return None
+
+
+def manifests_signature(path_to_out_dir):
+    "return the (filename, mtime, size) of the finished manifests, which changes whenever one of them does"
+    path_to_manifests = path_to_out_dir + "manifests/"
+    signature = []
+    for filename in list_manifests(path_to_out_dir):
+        try:
+            stat = os.stat(path_to_manifests + filename)
+            signature.append((filename, stat.st_mtime, stat.st_size))
+        except OSError:
+            continue
+    return signature
+
+
+def read_manifest(path_to_manifest_csv):
+    "return {job id: customId} from a manifest, a line cut off at the end of a partial manifest is ignored"
+    job_id_to_custom_id = {}
+    with open(path_to_manifest_csv, "rb") as _:
+        lines = _.read().split("\n")
+    # the last element is empty for a complete file and the cut off line otherwise
+    for line in csv.reader(lines[1:-1]):
+        if line:
+            job_id_to_custom_id[int(line[0])] = line[1]
+    return job_id_to_custom_id
+
+
+def read_manifests(path_to_out_dir, include_partial=False, run_id=None):
+    """return {job id: customId} of all shards in the output dir, if include_partial also of the unfinished manifests,
+    if run_id is given only of the manifests of this run"""
+    path_to_manifests = path_to_out_dir + "manifests/"
+    job_id_to_custom_id = {}
+    for filename in list_manifests(path_to_out_dir, include_partial, run_id):
+        job_id_to_custom_id.update(read_manifest(path_to_manifests + filename))
+    return job_id_to_custom_id
+
+
+def shards_cover_all_jobs(shards):
+    "return True if the (shard, shard count) pairs together cover every job id"
+    if not shards:
+        return False
+    period = 1
+    for _, shard_count in shards:
+        period = period * shard_count // gcd(period, shard_count)
+    covered = set()
+    for shard, shard_count in shards:
+        covered.update(xrange(shard, period, shard_count))
+    return len(covered) == period
+
+
+def remove_manifests_of_other_runs(path_to_out_dir, run_id, before, job_space=None):
+    """remove the finished manifests of runs other than run_id last changed before the time before
+    (e.g. the start of the producer), if job_space is given only the ones of other job spaces (or without one),
+    return their filenames, unfinished manifests and newer ones are kept, they may belong to a producer still running"""
+    path_to_manifests = path_to_out_dir + "manifests/"
+    removed = []
+    for filename in list_manifests(path_to_out_dir):
+        try:
+            if os.path.getmtime(path_to_manifests + filename) >= before:
+                continue
+            header = read_manifest_header(path_to_manifests + filename)
+            if not header or header[-1] == RUN_ID_PREFIX + run_id:
+                continue
+            if job_space is not None and len(header) > 1 and header[-2] == JOB_SPACE_PREFIX + job_space:
+                continue
+            os.remove(path_to_manifests + filename)
+            removed.append(filename)
+        except (IOError, OSError):
+            continue
+    return removed
+
+
+def read_complete_manifests(path_to_out_dir, run_id=None):
+    """return {job id: customId} of all shards in the output dir (of the run run_id if given)
+    or None as long as the finished manifests don't cover all shards of the job space"""
+    shards = []
+    for filename in list_manifests(path_to_out_dir, run_id=run_id):
+        match = _MANIFEST_NAME_RE.match(filename)
+        if match:
+            shards.append((int(match.group(1)), int(match.group(2))))
+    if not shards_cover_all_jobs(shards):
+        return None
+    return read_manifests(path_to_out_dir, run_id=run_id)
+
+
+class ManifestFollower(object):
+    """follows the manifests in the output dir while the producers append to them,
+    to look up the fields after the customId of a job (see manifest_header) by its id,
+    starting with the customId if with_custom_id, only in the manifests of the run run_id if given,
+    the jobs in skip (e.g. the ledger's done jobs) are left out"""
+
+    def __init__(self, path_to_out_dir, skip=(), min_interval=1.0, run_id=None, with_custom_id=False):
+        self.path_to_manifests = path_to_out_dir + "manifests/"
+        self.skip = skip
+        self.min_interval = min_interval
+        self.run_id = run_id
+        self._first_field = 1 if with_custom_id else 2
+        # inode -> bytes read, a manifest keeps its inode when it is renamed on close
+        self._offsets = {}
+        # inodes of the manifests of other runs
+        self._other_runs = set()
+        self._fields = {}
+        self._last_read = 0
+
+    def pop(self, job_id):
+        """return and forget the fields of the job, None if it isn't in a manifest,
+        the manifests are read again if the job isn't known yet, at most every min_interval seconds"""
+        fields = self._fields.pop(job_id, None)
+        if fields is None and time.time() - self._last_read >= self.min_interval:
+            self._read()
+            fields = self._fields.pop(job_id, None)
+        return fields
+
+    def get(self, job_id):
+        "return the fields of the job, None if it isn't in a manifest, the manifests are read again if it isn't known yet"
+        fields = self._fields.get(job_id)
+        if fields is None:
+            self._read()
+            fields = self._fields.get(job_id)
+        return fields
+
+    def discard(self, job_id):
+        "forget the fields of the job without reading the manifests"
+        self._fields.pop(job_id, None)
+
+    def _read(self):
+        "read the rows appended to the manifests since the last read"
+        self._last_read = time.time()
+        if not os.path.isdir(self.path_to_manifests):
+            return
+        offsets = {}
+        for filename in sorted(os.listdir(self.path_to_manifests)):
+            if not (filename.endswith(".csv") or filename.endswith(".csv" + PARTIAL_SUFFIX)):
+                continue
+            try:
+                with open(self.path_to_manifests + filename, "rb") as _:
+                    inode = os.fstat(_.fileno()).st_ino
+                    offset = self._offsets.get(inode, 0)
+                    _.seek(0, os.SEEK_END)
+                    if _.tell() < offset:
+                        # another file with the inode
+                        offset = 0
+                        self._other_runs.discard(inode)
+                    if inode in self._other_runs:
+                        offsets[inode] = offset
+                        continue
+                    _.seek(offset)
+                    text = _.read()
+            except IOError:
+                # renamed or removed by a producer meanwhile
+                continue
+            # a line cut off at the end is read with the next rows
+            end = text.rfind("\n") + 1
+            lines = text[:end].split("\n")[:-1]
+            if offset == 0 and lines and self.run_id is not None \
+            and next(csv.reader(lines[:1]), [""])[-1] != RUN_ID_PREFIX + self.run_id:
+                self._other_runs.add(inode)
+                offsets[inode] = end
+                continue
+            for row in csv.reader(lines[1:] if offset == 0 else lines):
+                if row:
+                    job_id = int(row[0])
+                    if job_id not in self.skip:
+                        self._fields[job_id] = row[self._first_field:]
+            offsets[inode] = offset + end
+        self._offsets = offsets
+        self._other_runs &= set(offsets)
+
+
+def path_to_duplicates(path_to_out_dir, shard, shard_count):
+    "return the path to the content hash -> customIds mapping of the deduplicated jobs of the given shard"
+    return path_to_out_dir + "duplicates/shard-" + str(shard) + "-of-" + str(shard_count) + ".csv"
+
+
+class ManifestWriter(object):
+    """writes the job id -> customId mapping of the jobs of a producer (shard) or rows with the given header,
+    the file gets its final name only when it is closed, so it is known to be complete"""
+
+    def __init__(self, path_to_manifest_csv, header=["job-id", "customId"], sync_interval=5.0):
+        path_to_dir = os.path.dirname(path_to_manifest_csv)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        self._path = path_to_manifest_csv
+        self._file = open(path_to_manifest_csv + PARTIAL_SUFFIX, "wb")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(header)
+        # other producers tell the manifest's run by its header
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.sync_interval = sync_interval
+        self._last_sync = time.time()
+
+    def write(self, *fields):
+        self._writer.writerow(fields)
+
+    def flush(self):
+        "hand the written rows to the OS, so they survive the process, and sync them to disk every sync_interval seconds"
+        self._file.flush()
+        if time.time() - self._last_sync >= self.sync_interval:
+            os.fsync(self._file.fileno())
+            self._last_sync = time.time()
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.rename(self._path + PARTIAL_SUFFIX, self._path)
+
+
+def path_to_ledger(path_to_out_dir):
+    "return the path to the completion ledger in the output dir"
+    return path_to_out_dir + "ledger.csv"
+
+
+def _read_committed(path_to_ledger_csv):
+    """return (job ids, state, size in bytes, number of state lines) of the committed part of a ledger,
+    the job ids followed by a state line ("#" and the state as JSON), of a ledger without state lines
+    all its complete lines"""
+    done = set()
+    state = {}
+    size = 0
+    state_lines = 0
+    if not os.path.isfile(path_to_ledger_csv):
+        return done, state, size, state_lines
+    with open(path_to_ledger_csv, "rb") as _:
+        lines = _.read().split("\n")
+    pending = []
+    position = 0
+    # only the last state line is parsed, the earlier ones are superseded by it
+    last_state_line = None
+    # the last element is empty for a complete file and the line cut off by a crash otherwise
+    for line in lines[:-1]:
+        position += len(line) + 1
+        if line.startswith("#"):
+            last_state_line = line
+            state_lines += 1
+            done.update(pending)
+            del pending[:]
+            size = position
+        elif line.strip().isdigit():
+            pending.append(int(line))
+    if last_state_line is None:
+        done.update(pending)
+        size = position
+    else:
+        state = json.loads(last_state_line[1:])
+    return done, state, size, state_lines
+
+
+def read_ledger(path_to_ledger_csv, run_id=None):
+    "return the set of job ids recorded as done, if run_id is given empty if the ledger belongs to another run"
+    done, state, _, _ = _read_committed(path_to_ledger_csv)
+    if run_id is not None and state.get("run-id") != run_id:
+        return set()
+    return done
+
+
+class Ledger(object):
+    """append only record of the ids of the jobs of a run whose results have been written,
+    committed together with the state of the output they have been written to (see output_writers)
+    and the run id (in the state), job ids after the last state line (cut off by a crash) are removed
+    when the ledger is opened, the ledger is compacted to the job ids and the last state line
+    when it is opened and every compact_interval state lines"""
+
+    def __init__(self, path_to_ledger_csv, compact_interval=1000):
+        self.done, self.state, size, self._state_lines = _read_committed(path_to_ledger_csv)
+        self._path = path_to_ledger_csv
+        self._pending = []
+        self.compact_interval = compact_interval
+        path_to_dir = os.path.dirname(path_to_ledger_csv)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        if os.path.isfile(path_to_ledger_csv) and os.path.getsize(path_to_ledger_csv) > size:
+            print "removing", os.path.getsize(path_to_ledger_csv) - size, "uncommitted bytes at the end of", \
+            path_to_ledger_csv
+            with open(path_to_ledger_csv, "r+b") as _:
+                _.truncate(size)
+        self._file = open(path_to_ledger_csv, "a")
+        if self._state_lines > 1:
+            self.compact()
+
+    @property
+    def run_id(self):
+        "the run the recorded jobs belong to, None for a ledger without one (e.g. written by an older consumer)"
+        return self.state.get("run-id")
+
+    def start_run(self, run_id, state=None):
+        """replace the ledger by an empty one of the run run_id, committed with state (the last state if None),
+        the job ids of another run would skip the results of this run's jobs with the same ids"""
+        self.done = set()
+        del self._pending[:]
+        self._rewrite(dict(self.state if state is None else state, **{"run-id": run_id}))
+
+    def compact(self):
+        "replace the ledger by one with the job ids done and only the last state line, the pending ids are kept pending"
+        self._rewrite(self.state)
+
+    def _rewrite(self, state):
+        "replace the ledger by the done job ids (but the pending ones) and one state line, atomically"
+        pending = set(self._pending)
+        path_to_new_ledger_csv = self._path + PARTIAL_SUFFIX
+        with open(path_to_new_ledger_csv, "wb") as _:
+            _.write("".join(str(job_id) + "\n" for job_id in sorted(self.done) if job_id not in pending)
+                    + "#" + json.dumps(state, sort_keys=True, separators=(",", ":")) + "\n")
+            _.flush()
+            os.fsync(_.fileno())
+        self._file.close()
+        os.rename(path_to_new_ledger_csv, self._path)
+        self._file = open(self._path, "a")
+        self.state = state
+        self._state_lines = 1
+
+    def __contains__(self, job_id):
+        return job_id in self.done
+
+    def record(self, job_id):
+        "mark job_id as done, it is written to the ledger by the next flush"
+        self.done.add(job_id)
+        self._pending.append(job_id)
+
+    def flush(self, state=None):
+        """append the job ids recorded since the last flush and the state of the output they have been written to
+        (the last state if None) in one line and sync the ledger to disk"""
+        if state is None:
+            state = self.state
+        if self._pending or state != self.state:
+            self._file.write("".join(str(job_id) + "\n" for job_id in self._pending)
+                             + "#" + json.dumps(state, sort_keys=True, separators=(",", ":")) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            del self._pending[:]
+            self.state = state
+            self._state_lines += 1
+            if self._state_lines >= self.compact_interval:
+                self.compact()
+
+    def close(self):
+        self.flush()
+        self._file.close()
@@ -0,0 +1,278 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+# Tommaso Stella <tommaso.stella@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import csv
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# the columns of the rows created by the consumer's create_output
+COLUMNS = [
+    "lat", "lon", "elevation", "year", "sow-doy", "em-doy", "flow-doy", "mat-doy", "harv-doy", "harv-stage",
+    "crop-Tavg", "yield", "abbiom-harv", "LAImax", "applied-N", "N-leaching", "N-uptake", "cycle-length",
+    "precip-sum", "TraDefavg", "TraDef1", "TraDef2", "TraDef3", "TraDef4", "TraDef5", "TraDef6", "TraDef7",
+    "act-transp", "act-ET", "NDefavg", "NDef1", "NDef2", "NDef3", "NDef4", "NDef5", "NDef6", "NDef7"
+]
+
+CSV_HEADER = ", ".join(COLUMNS) + "\n"
+
+# columnar store: coordinates as float64, all other values as float32 with NaN for missing values
+DTYPE = np.dtype([(column, np.float64 if column in ["lat", "lon", "elevation"] else np.float32) 
+                  for column in COLUMNS])
+
+# columns holding whole numbers, exported without decimal places
+INTEGER_COLUMNS = set(["year", "sow-doy", "em-doy", "flow-doy", "mat-doy", "harv-doy", "harv-stage", "cycle-length"])
+
+
+class CsvWriterPool(object):
+    """appends rows to many csv files (one per scenario name), keeping the most recently used files open
+    and buffering rows in memory until a file's buffer is full or a checkpoint is due,
+    the files' sizes at the last checkpoint are its state, the files can be cut back to them by restore"""
+
+    def __init__(self, path_to_out_dir, header=CSV_HEADER, max_open_files=64, max_buffered_rows=5000,
+                 checkpoint_interval=30.0):
+        self.path_to_out_dir = path_to_out_dir
+        self.header = header
+        self.max_open_files = max_open_files
+        self.max_buffered_rows = max_buffered_rows
+        self.checkpoint_interval = checkpoint_interval
+        self._files = OrderedDict()
+        self._buffers = {}
+        # filename -> size at the last sync
+        self._sizes = {}
+        self._last_checkpoint = time.time()
+
+    def restore(self, state):
+        """cut the csv files back to their sizes in state (see state) and remove the ones created since,
+        their rows written after the checkpoint belong to jobs not recorded as done, which are received again"""
+        sizes = (state or {}).get("csv")
+        if not os.path.isdir(self.path_to_out_dir):
+            return
+        for filename in sorted(os.listdir(self.path_to_out_dir)):
+            path_to_file = self.path_to_out_dir + filename
+            if not filename.endswith(".csv") or not os.path.isfile(path_to_file):
+                continue
+            with open(path_to_file, "rb") as _:
+                if _.read(len(self.header)) != self.header:
+                    continue
+            if sizes is not None:
+                size = sizes.get(filename)
+                if size is None:
+                    print "removing", path_to_file, "created after the last checkpoint"
+                    os.remove(path_to_file)
+                    continue
+                if os.path.getsize(path_to_file) > size:
+                    print "removing", os.path.getsize(path_to_file) - size, "bytes written after the last checkpoint", \
+                    "from", path_to_file
+                    with open(path_to_file, "r+b") as _:
+                        _.truncate(size)
+            self._sizes[filename] = os.path.getsize(path_to_file)
+
+    def state(self):
+        "return the sizes of the files, as of the last checkpoint right after it"
+        return {"csv": dict(self._sizes)}
+
+    def write_rows(self, name, rows):
+        "buffer rows for the csv file of name, the header is written first if the file doesn't exist yet"
+        path_to_file = self.path_to_out_dir + name + ".csv"
+        buffer = self._buffers.get(path_to_file)
+        if buffer is None:
+            buffer = self._buffers[path_to_file] = []
+        buffer.extend(rows)
+        if len(buffer) >= self.max_buffered_rows:
+            self._flush_buffer(path_to_file)
+
+    def _open(self, path_to_file):
+        "return the open file, opening it (and closing the least recently used one) if necessary"
+        out_file = self._files.pop(path_to_file, None)
+        if out_file is None:
+            if len(self._files) >= self.max_open_files:
+                _, lru_file = self._files.popitem(last=False)
+                self._close(lru_file)
+            is_new = not os.path.isfile(path_to_file)
+            out_file = open(path_to_file, "ab")
+            if is_new:
+                out_file.write(self.header)
+        self._files[path_to_file] = out_file
+        return out_file
+
+    def _sync(self, out_file):
+        out_file.flush()
+        os.fsync(out_file.fileno())
+        self._sizes[os.path.basename(out_file.name)] = os.fstat(out_file.fileno()).st_size
+
+    def _close(self, out_file):
+        self._sync(out_file)
+        out_file.close()
+
+    def _flush_buffer(self, path_to_file):
+        buffer = self._buffers.get(path_to_file)
+        if buffer:
+            writer = csv.writer(self._open(path_to_file), delimiter=",")
+            writer.writerows(buffer)
+            del buffer[:]
+
+    def is_checkpoint_due(self):
+        return time.time() - self._last_checkpoint >= self.checkpoint_interval
+
+    def checkpoint(self):
+        "write all buffered rows and sync the open files to disk"
+        for path_to_file in self._buffers.keys():
+            self._flush_buffer(path_to_file)
+        for out_file in self._files.itervalues():
+            self._sync(out_file)
+        self._last_checkpoint = time.time()
+
+    def close(self):
+        "write all buffered rows and close all files"
+        self.checkpoint()
+        for out_file in self._files.itervalues():
+            out_file.close()
+        self._files.clear()
+        self._buffers.clear()
+
+
+def to_columns(rows):
+    "convert rows as created by create_output into a structured array, 'NA' becomes NaN"
+    columns = zip(*rows) if rows else [[]] * len(COLUMNS)
+    array = np.empty(len(rows), dtype=DTYPE)
+    for column, values in zip(COLUMNS, columns):
+        array[column] = [np.nan if value == "NA" or value is None else float(value) for value in values]
+    return array
+
+
+class ColumnarWriterPool(object):
+    """appends rows to a columnar store, one directory per scenario name holding chunks of rows
+    as structured .npy arrays (see DTYPE), a chunk is written when the scenario's buffer is full or at a checkpoint,
+    the scenarios' last chunks at the last checkpoint are its state, later chunks can be removed by restore"""
+
+    def __init__(self, path_to_store_dir, max_buffered_rows=50000, checkpoint_interval=30.0):
+        self.path_to_store_dir = path_to_store_dir
+        self.max_buffered_rows = max_buffered_rows
+        self.checkpoint_interval = checkpoint_interval
+        self._buffers = {}
+        # scenario name -> number of its last chunk
+        self._last_chunks = {}
+        self._last_checkpoint = time.time()
+
+    def restore(self, state):
+        """remove the chunks written after the ones in state (see state),
+        their rows belong to jobs not recorded as done, which are received again"""
+        last_chunks = (state or {}).get("npy")
+        for name in list_partitions(self.path_to_store_dir):
+            path_to_partition = self.path_to_store_dir + name + "/"
+            for filename in sorted(os.listdir(path_to_partition)):
+                if filename.endswith(".tmp"):
+                    os.remove(path_to_partition + filename)
+                elif filename.startswith("chunk-") and filename.endswith(".npy"):
+                    chunk_no = int(filename[6:-4])
+                    if last_chunks is not None and chunk_no > last_chunks.get(name, -1):
+                        print "removing", path_to_partition + filename, "written after the last checkpoint"
+                        os.remove(path_to_partition + filename)
+                    else:
+                        self._last_chunks[name] = max(self._last_chunks.get(name, -1), chunk_no)
+
+    def state(self):
+        "return the numbers of the scenarios' last chunks, as of the last checkpoint right after it"
+        return {"npy": dict(self._last_chunks)}
+
+    def write_rows(self, name, rows):
+        "buffer rows for the scenario name"
+        buffer = self._buffers.setdefault(name, [])
+        buffer.extend(rows)
+        if len(buffer) >= self.max_buffered_rows:
+            self._write_chunk(name)
+
+    def _write_chunk(self, name):
+        buffer = self._buffers.get(name)
+        if not buffer:
+            return
+
+        path_to_partition = self.path_to_store_dir + name + "/"
+        if not os.path.isdir(path_to_partition):
+            os.makedirs(path_to_partition)
+        chunk_nos = [int(filename[6:-4]) for filename in os.listdir(path_to_partition)
+                     if filename.startswith("chunk-") and filename.endswith(".npy")]
+        chunk_no = max(chunk_nos) + 1 if chunk_nos else 0
+        path_to_chunk = path_to_partition + "chunk-" + str(chunk_no).zfill(6) + ".npy"
+
+        # write to a temporary file first, so that readers never see a partial chunk
+        with open(path_to_chunk + ".tmp", "wb") as _:
+            np.save(_, to_columns(buffer))
+            _.flush()
+            os.fsync(_.fileno())
+        os.rename(path_to_chunk + ".tmp", path_to_chunk)
+        self._last_chunks[name] = chunk_no
+        del buffer[:]
+
+    def is_checkpoint_due(self):
+        return time.time() - self._last_checkpoint >= self.checkpoint_interval
+
+    def checkpoint(self):
+        "write all buffered rows as chunks"
+        for name in self._buffers.keys():
+            self._write_chunk(name)
+        self._last_checkpoint = time.time()
+
+    def close(self):
+        self.checkpoint()
+        self._buffers.clear()
+
+
+def list_partitions(path_to_store_dir):
+    "return the scenario names in the columnar store"
+    if not os.path.isdir(path_to_store_dir):
+        return []
+    return sorted(name for name in os.listdir(path_to_store_dir) if os.path.isdir(path_to_store_dir + name))
+
+
+def read_partition(path_to_store_dir, name, lat=None, lon=None, from_year=None, to_year=None, columns=None):
+    """return the rows of scenario name as structured array, optionally only for one site (lat, lon),
+    for the years from_year to to_year and with the given columns"""
+    path_to_partition = path_to_store_dir + name + "/"
+    dtype = np.dtype([(column, DTYPE[column]) for column in columns]) if columns else DTYPE
+    parts = []
+    for filename in sorted(os.listdir(path_to_partition)):
+        if not (filename.startswith("chunk-") and filename.endswith(".npy")):
+            continue
+        chunk = np.load(path_to_partition + filename, mmap_mode="r")
+        selected = np.ones(len(chunk), dtype=bool)
+        if lat is not None:
+            selected &= chunk["lat"] == lat
+        if lon is not None:
+            selected &= chunk["lon"] == lon
+        if from_year is not None:
+            selected &= chunk["year"] >= from_year
+        if to_year is not None:
+            selected &= chunk["year"] <= to_year
+        part = np.empty(np.count_nonzero(selected), dtype=dtype)
+        for column in dtype.names:
+            part[column] = chunk[column][selected]
+        parts.append(part)
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def format_value(column, value):
+    "format a value of the columnar store the way it appears in the csv output"
+    if np.isnan(value):
+        return "NA"
+    if column in INTEGER_COLUMNS and float(value).is_integer():
+        return str(int(value))
+    return str(value)
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+import re
+from collections import OrderedDict
+
+import numpy as np
+
+import results_io
+
+# the output values aggregated by default
+METRICS = ["yield", "abbiom-harv", "N-leaching", "precip-sum", "TraDefavg", "NDefavg"]
+
+PERCENTILES = [5, 25, 50, 75, 95]
+
+# the levels values are aggregated at: per scenario, per scenario and elevation band, per scenario and site
+LEVELS = ["scenario", "band", "site"]
+
+_STATE_NAME_RE = re.compile(r"^state-(\d+)\.json$")
+
+
+class Aggregate(object):
+    """online count, mean, variance, min and max of a stream of batches of values (merged as by Chan et al.)
+    and a mergeable quantile sketch of them (a merging t-digest, the larger capacity the more centroids it keeps),
+    as long as there are not more than capacity values the quantiles are exact"""
+
+    __slots__ = ["capacity", "count", "mean", "m2", "min", "max", "_centroids", "_buffer"]
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        # [[mean, weight]] sorted by mean
+        self._centroids = []
+        self._buffer = []
+
+    def add_batch(self, values, count, mean, m2, min_, max_):
+        "add a list of values whose count, mean, m2 (sum of squared deviations), min and max are already known"
+        self._merge_moments(count, mean, m2, min_, max_)
+        self._buffer.extend(values)
+        # compressing is the most expensive part, so it is done on a larger batch of values
+        if len(self._buffer) >= 4 * self.capacity:
+            self._compress()
+
+    def _merge_moments(self, count, mean, m2, min_, max_):
+        "merge the count, mean, m2, min and max of other values into the own ones (Chan et al.)"
+        total = self.count + count
+        delta = float(mean) - self.mean
+        self.m2 += float(m2) + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.min = float(min_) if self.min is None else min(self.min, float(min_))
+        self.max = float(max_) if self.max is None else max(self.max, float(max_))
+
+    def merge(self, other):
+        "add the values aggregated by other"
+        if other.count == 0:
+            return
+        self._merge_moments(other.count, other.mean, other.m2, other.min, other.max)
+        self._centroids.extend([centroid[0], centroid[1]] for centroid in other._centroids)
+        self._buffer.extend(other._buffer)
+        self._compress()
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def _compress(self):
+        """merge the buffered values into the centroids, the closer to the median the heavier a centroid may get:
+        the points are binned by the arcsine scale of their quantile (t-digest's k1), at most capacity bins"""
+        centroids = np.array(self._centroids, dtype=np.float64).reshape(-1, 2)
+        means = np.concatenate([centroids[:, 0], self._buffer])
+        weights = np.concatenate([centroids[:, 1], np.ones(len(self._buffer))])
+        del self._buffer[:]
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        if len(means) <= self.capacity:
+            self._centroids = np.column_stack([means, weights]).tolist()
+            return
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2.0) / cumulative[-1]
+        bins = np.minimum(np.floor(self.capacity * (np.arcsin(2.0 * q - 1.0) / np.pi + 0.5)), self.capacity - 1)
+        # the points are sorted, so are the bins
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        bin_weights = np.add.reduceat(weights, starts)
+        bin_means = np.add.reduceat(means * weights, starts) / bin_weights
+        self._centroids = np.column_stack([bin_means, bin_weights]).tolist()
+
+    def quantile(self, q):
+        "return the estimated q (0..1) quantile or None if there are no values"
+        if self._buffer:
+            self._compress()
+        centroids = self._centroids
+        if not centroids:
+            return None
+        if len(centroids) == 1:
+            return centroids[0][0]
+        # interpolate between the centroids' centers, below the first and above the last towards min and max
+        target = q * self.count
+        weight_before = 0.0
+        prev_center, prev_value = 0.0, self.min
+        for value, weight in centroids:
+            center = weight_before + weight / 2.0
+            if target <= center:
+                if center == prev_center:
+                    return value
+                return prev_value + (value - prev_value) * (target - prev_center) / (center - prev_center)
+            prev_center, prev_value = center, value
+            weight_before += weight
+        if self.count == prev_center:
+            return self.max
+        return prev_value + (self.max - prev_value) * (target - prev_center) / (self.count - prev_center)
+
+    def summary(self, percentiles):
+        "return count, mean, std, min, max and the percentiles as dict"
+        summary = OrderedDict([("count", self.count), ("mean", self.mean), ("std", self.variance() ** 0.5),
+                               ("min", self.min), ("max", self.max)])
+        for percentile in percentiles:
+            summary["p" + str(percentile)] = self.quantile(percentile / 100.0)
+        return summary
+
+    def to_list(self):
+        "return the state as list (for json)"
+        if self._buffer:
+            self._compress()
+        return [self.count, self.mean, self.m2, self.min, self.max, self._centroids]
+
+    @staticmethod
+    def from_list(state, capacity=50):
+        aggregate = Aggregate(capacity)
+        aggregate.count, aggregate.mean, aggregate.m2, aggregate.min, aggregate.max, aggregate._centroids = state
+        return aggregate
+
+
+def baseline_scenario(name):
+    "return the name of the baseline scenario corresponding to the scenario name (see results_io.scenario_name)"
+    cultivar, _, rest = name.split("_", 2)
+    return cultivar + "_baseline_" + rest
+
+
+class ResultAggregates(object):
+    """aggregates the metrics of the output rows (as created by results_io.create_output) as they are written,
+    per scenario, per scenario and elevation band and per scenario and site,
+    the state is checkpointed to a new numbered json file each time, the number of the last one is its state
+    (see state), committed with the ledger, the aggregates are resumed from it by restore,
+    and a summary json is written for lookups"""
+
+    def __init__(self, path_to_aggregates_dir, metrics=METRICS, levels=LEVELS, percentiles=PERCENTILES, capacity=50):
+        unknown_levels = set(levels) - set(LEVELS)
+        if unknown_levels:
+            raise Exception("unknown aggregate levels " + ",".join(sorted(unknown_levels)) \
+            + ", choose from " + ",".join(LEVELS))
+        self.path_to_aggregates_dir = path_to_aggregates_dir
+        self.metrics = metrics
+        self.levels = levels
+        self.percentiles = percentiles
+        self.capacity = capacity
+        self.jobs = 0
+        self._columns = [3 + results_io.OUTPUT_NAME_TO_COLUMN[metric] for metric in metrics]
+        # level -> {(scenario name, level key): [aggregate per metric]}
+        self._aggregates = {level: {} for level in levels}
+        # the number of the last checkpointed state file, None before the first checkpoint
+        self._version = None
+        self._next_version = 0
+
+    def reset(self):
+        "forget the aggregated jobs, e.g. of an earlier run"
+        self.jobs = 0
+        self._aggregates = {level: {} for level in self.levels}
+        self._version = None
+
+    def _list_states(self):
+        "return {number: filename} of the state files"
+        if not os.path.isdir(self.path_to_aggregates_dir):
+            return {}
+        states = {}
+        for filename in os.listdir(self.path_to_aggregates_dir):
+            match = _STATE_NAME_RE.match(filename)
+            if match:
+                states[int(match.group(1))] = filename
+        return states
+
+    def path_to_state(self, version):
+        return self.path_to_aggregates_dir + "state-" + str(version) + ".json"
+
+    def path_to_summary(self):
+        return self.path_to_aggregates_dir + "summary.json"
+
+    def restore(self, state):
+        """resume the aggregates from the state file in state (see state) and remove the other state files,
+        the ones written after it aggregate jobs not recorded as done, which are received again,
+        without a state file in state the aggregates start empty"""
+        version = (state or {}).get("aggregates")
+        states = self._list_states()
+        self._next_version = max(states.keys() + [version if version is not None else -1]) + 1
+        for other_version, filename in states.iteritems():
+            if other_version != version:
+                if version is None or other_version > version:
+                    print "removing", self.path_to_aggregates_dir + filename, "written after the last checkpoint"
+                os.remove(self.path_to_aggregates_dir + filename)
+        if version is None:
+            return
+        with open(self.path_to_state(version)) as _:
+            state = json.load(_)
+        if state["metrics"] != self.metrics or sorted(state["levels"].iterkeys()) != sorted(self.levels):
+            raise Exception("the aggregates in " + self.path_to_state(version) + " are of the metrics " \
+            + ",".join(state["metrics"]) + " at the levels " + ",".join(sorted(state["levels"].iterkeys())) \
+            + ", not " + ",".join(self.metrics) + " at " + ",".join(sorted(self.levels)))
+        self._version = version
+        self.jobs = state["jobs"]
+        for level in self.levels:
+            aggregates = self._aggregates[level]
+            for name, key, metric_states in state["levels"][level]:
+                aggregates[(name, key)] = [Aggregate.from_list(metric_state, self.capacity)
+                                           for metric_state in metric_states]
+
+    def _metric_aggregates(self, level, name, key):
+        metric_aggregates = self._aggregates[level].get((name, key))
+        if metric_aggregates is None:
+            metric_aggregates = self._aggregates[level][(name, key)] = [Aggregate(self.capacity) for _ in self.metrics]
+        return metric_aggregates
+
+    def add_rows(self, name, rows):
+        "aggregate the rows of a job of scenario name, 'NA' values are skipped"
+        self.jobs += 1
+        if not rows:
+            return
+        lat, lon, elevation = rows[0][:3]
+        targets = []
+        if "scenario" in self.levels:
+            targets.append(self._metric_aggregates("scenario", name, ""))
+        if "band" in self.levels:
+            band = results_io.ELEVATION_BANDS[results_io.elevation_band(float(elevation))]
+            targets.append(self._metric_aggregates("band", name, band))
+        if "site" in self.levels:
+            targets.append(self._metric_aggregates("site", name, str(lat) + "|" + str(lon)))
+
+        # the metrics of all rows at once, so the aggregates' costs are per job rather than per value
+        table = [[row[column] for column in self._columns] for row in rows]
+        try:
+            table = np.array(table, dtype=np.float64)
+        except (TypeError, ValueError):
+            table = np.array([[value if isinstance(value, (int, long, float)) else np.nan for value in values]
+                              for values in table], dtype=np.float64)
+        is_valid = ~np.isnan(table)
+        counts = is_valid.sum(axis=0)
+        means = np.where(is_valid, table, 0.0).sum(axis=0) / np.maximum(counts, 1)
+        m2s = (np.where(is_valid, table - means, 0.0) ** 2).sum(axis=0)
+        mins = np.where(is_valid, table, np.inf).min(axis=0)
+        maxs = np.where(is_valid, table, -np.inf).max(axis=0)
+        for metric_index in xrange(len(self._columns)):
+            if counts[metric_index] == 0:
+                continue
+            values = table[is_valid[:, metric_index], metric_index].tolist()
+            moments = (int(counts[metric_index]), means[metric_index], m2s[metric_index], mins[metric_index],
+                       maxs[metric_index])
+            for metric_aggregates in targets:
+                metric_aggregates[metric_index].add_batch(values, *moments)
+
+    def summary(self):
+        """return {level: {scenario name: {level key: {metric: summary}}}},
+        the entries of non baseline scenarios get the difference of the means to the baseline as mean-delta"""
+        summary = OrderedDict([("jobs", self.jobs)])
+        for level in self.levels:
+            aggregates = self._aggregates[level]
+            level_summary = summary[level] = OrderedDict()
+            for name, key in sorted(aggregates.iterkeys()):
+                baseline = None
+                if name.split("_")[1] != "baseline":
+                    baseline = aggregates.get((baseline_scenario(name), key))
+                entry = OrderedDict()
+                for metric_index, metric in enumerate(self.metrics):
+                    aggregate = aggregates[(name, key)][metric_index]
+                    entry[metric] = aggregate.summary(self.percentiles)
+                    if baseline is not None and baseline[metric_index].count > 0 and aggregate.count > 0:
+                        entry[metric]["mean-delta"] = aggregate.mean - baseline[metric_index].mean
+                level_summary.setdefault(name, OrderedDict())[key] = entry
+        return summary
+
+    def _write_json(self, path_to_json, obj, **kwargs):
+        "write to a temporary file first, so that readers never see a partial file"
+        with open(path_to_json + ".tmp", "w") as _:
+            json.dump(obj, _, **kwargs)
+            _.flush()
+            os.fsync(_.fileno())
+        os.rename(path_to_json + ".tmp", path_to_json)
+
+    def state(self):
+        "return the number of the last state file, as of the last checkpoint right after it"
+        return {"aggregates": self._version}
+
+    def checkpoint(self):
+        """write the state to a new file and the summary, remove the state files but the new one
+        and the last one, which is referenced by the ledger until it is committed with the new one"""
+        if not os.path.isdir(self.path_to_aggregates_dir):
+            os.makedirs(self.path_to_aggregates_dir)
+        state = {
+            "jobs": self.jobs,
+            "metrics": self.metrics,
+            "levels": {level: [[name, key, [aggregate.to_list() for aggregate in metric_aggregates]]
+                               for (name, key), metric_aggregates in self._aggregates[level].iteritems()]
+                       for level in self.levels}
+        }
+        version = self._next_version
+        self._write_json(self.path_to_state(version), state, separators=(",", ":"))
+        self._write_json(self.path_to_summary(), self.summary(), indent=1)
+        for other_version, filename in self._list_states().iteritems():
+            if other_version not in (version, self._version):
+                os.remove(self.path_to_aggregates_dir + filename)
+        self._version = version
+        self._next_version = version + 1
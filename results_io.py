@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+# Tommaso Stella <tommaso.stella@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import time
+import types
+
+import numpy as np
+
+import jobs_io
+import wire_format
+
+# names of the values in the rows created by create_output, following lat, lon and elevation
+OUTPUT_NAMES = [
+    "Year", "sow-doy", "em-doy", "flow-doy", "mat-doy", "harv-doy", "harv-stage", "Tavg", "yield", "abbiom-harv",
+    "LAImax", "applied-N", "N-leaching", "N-uptake", "cycle-length", "precip-sum", "TraDefavg", "TraDef1", "TraDef2",
+    "TraDef3", "TraDef4", "TraDef5", "TraDef6", "TraDef7", "act-transp", "act-ET", "NDefavg", "NDef1", "NDef2",
+    "NDef3", "NDef4", "NDef5", "NDef6", "NDef7"
+]
+OUTPUT_NAME_TO_COLUMN = {name: column for column, name in enumerate(OUTPUT_NAMES)}
+
+# keys into the producer's elevation_ranges, indexed by the band column of its site table
+ELEVATION_BANDS = ["<1600", "=>1600&<=1900", ">1900"]
+
+def elevation_band(elevation):
+    "return the index into ELEVATION_BANDS for a (array of) elevation(s)"
+    return np.where(elevation < 1600, 0, np.where(elevation <= 1900, 1, 2))
+
+# compiled output plans by the signature of the results' outputIds
+OUTPUT_PLANS = {}
+
+def output_ids_signature(result):
+    "return a hashable signature of the outputIds of all data sections"
+    return tuple(tuple((oid["name"], oid["displayName"]) for oid in data.get("outputIds", []))
+                 for data in result.get("data", []))
+
+def compile_output_plan(result):
+    """compile for every data section the index of the (last) Year output id 
+    and the (output id index, column) pairs of the output ids which are part of OUTPUT_NAMES"""
+    plan = []
+    for data in result.get("data", []):
+        names = [oid["name"] if len(oid["displayName"]) == 0 else oid["displayName"] for oid in data.get("outputIds", [])]
+        year_index = len(names) - 1 - names[::-1].index("Year") if "Year" in names else None
+        columns = [(iii, OUTPUT_NAME_TO_COLUMN[name]) for iii, name in enumerate(names) if name in OUTPUT_NAME_TO_COLUMN]
+        plan.append((year_index, columns))
+    return plan
+
+def create_output(result, lat, lon, elevation):
+    "create output structure for single run"
+
+    if len(result.get("data", [])) == 0 or len(result["data"][0].get("results", [])) == 0:
+        return []
+
+    signature = output_ids_signature(result)
+    plan = OUTPUT_PLANS.get(signature)
+    if plan is None:
+        plan = OUTPUT_PLANS[signature] = compile_output_plan(result)
+
+    sections = []
+    years = set()
+    for data, (year_index, columns) in zip(result["data"], plan):
+        results = data.get("results", [])
+
+        #skip empty results, e.g. when event condition haven't been met
+        if len(results) == 0:
+            continue
+
+        assert len(data["outputIds"]) == len(results)
+        if year_index is None:
+            raise KeyError("Year")
+        section_years = results[year_index]
+        years.update(section_years)
+        sections.append((section_years, results, columns))
+
+    # values of later sections overwrite those of earlier sections for the same year
+    years = sorted(years)
+    year_to_row = {year: row for row, year in enumerate(years)}
+    all_rows = range(len(years))
+    columns = [None] * len(OUTPUT_NAMES)
+    for section_years, results, section_columns in sections:
+        rows = [year_to_row[year] for year in section_years]
+        is_repeating_years = len(set(rows)) < len(rows)
+        # an output's values are either all lists or none (its aggregation), so its first value tells
+        has_list_values = any(len(results[iii]) > 0 and isinstance(results[iii][0], types.ListType)
+                              for iii, _ in section_columns)
+
+        if is_repeating_years or has_list_values:
+            # assign row by row to keep the order in which values overwrite each other,
+            # the last element of list values is used, empty lists are ignored
+            for kkk, row in enumerate(rows):
+                for iii, column in section_columns:
+                    if columns[column] is None:
+                        columns[column] = ["NA"] * len(years)
+                    val = results[iii][kkk]
+                    if not isinstance(val, types.ListType):
+                        columns[column][row] = val
+                    elif len(val) > 0:
+                        columns[column][row] = val[-1]
+
+        elif rows == all_rows:
+            # the section covers all years in order, take its columns as they are
+            for iii, column in section_columns:
+                columns[column] = list(results[iii])
+
+        else:
+            for iii, column in section_columns:
+                if columns[column] is None:
+                    columns[column] = ["NA"] * len(years)
+                out_column = columns[column]
+                for row, val in zip(rows, results[iii]):
+                    out_column[row] = val
+
+    na_column = ["NA"] * len(years)
+    columns = [[lat] * len(years), [lon] * len(years), [elevation] * len(years)] \
+    + [na_column if column is None else column for column in columns]
+    return map(list, zip(*columns))
+
+
+def scenario_name(cultivar, rcp, sowing, fertilizer, cycle_length):
+    "return the name of the output (file) of a scenario"
+    sowing_shortcut = "-".join(map(lambda x: x[:3], sowing.split("/")))
+    return cultivar + "_" + rcp + "_s-" + sowing_shortcut + "_f-" + fertilizer + "_c-" + cycle_length[:3]
+
+
+def process_result(result, timings=None):
+    """return (job id, scenario name, output rows, [(job id, output rows)] of the duplicate jobs) of a work result,
+    the time spent creating the rows is added to timings["create-output"] if given"""
+    custom_id = result["customId"]
+    ci_parts = custom_id.split("|")
+    cultivar = ci_parts[0]
+    lat = ci_parts[1]
+    lon = ci_parts[2]
+    rcp = ci_parts[3]
+    sowing = ci_parts[4]
+    fertilizer = ci_parts[5]
+    cycle_length = ci_parts[6]
+    elevation = ci_parts[7]
+
+    start = time.time()
+    rows = create_output(result, lat, lon, elevation)
+    # the result of a job simulated for several sites with identical inputs is written for each of them
+    duplicates = [(int(job_id), [[dlat, dlon, delevation] + row[3:] for row in rows])
+                  for dlat, dlon, delevation, job_id in jobs_io.duplicates_from_custom_id(custom_id)]
+    if timings is not None:
+        timings["create-output"] = time.time() - start
+    return jobs_io.job_id_from_custom_id(custom_id), scenario_name(cultivar, rcp, sowing, fertilizer, cycle_length), \
+    rows, duplicates
+
+
+def process_message(msg):
+    """decode a raw (plain or compressed) message and process it, return ("finish", None, timings)
+    or ("result", (customId, job id, scenario name, output rows, duplicates), timings),
+    timings are the seconds spent in the stages parse (including decompression) and create-output"""
+    start = time.time()
+    result = json.loads(wire_format.decode(msg), encoding="latin-1")
+    timings = {"parse": time.time() - start}
+    if result["type"] == "finish":
+        return "finish", None, timings
+    return "result", (result["customId"],) + process_result(result, timings), timings
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import jobs_io
+
+PATH_TO_REPOSITORY = os.path.dirname(os.path.abspath(__file__)) + "/"
+
+
+def wait_for(process):
+    "wait for process to exit and return its peak resident memory in MB"
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = status
+    # ru_maxrss is in KB on linux
+    return rusage.ru_maxrss / 1024.0
+
+
+def read_metrics(path_to_metrics_dir, prefix):
+    "return the summed messages, bytes and the longest seconds of the metrics json files starting with prefix"
+    total = {"messages": 0, "bytes": 0, "seconds": 0.0}
+    for filename in sorted(os.listdir(path_to_metrics_dir)):
+        if filename.startswith(prefix) and filename.endswith(".json"):
+            with open(path_to_metrics_dir + filename) as _:
+                metrics = json.load(_)
+            total["messages"] += metrics["messages"]
+            total["bytes"] += metrics["bytes"]
+            total["seconds"] = max(total["seconds"], metrics["seconds"])
+    return total
+
+
+def check_manifests(path_to_out_dir, shard_count):
+    "return the problems with the manifests of the shard_count (sub) shards of a finished run"
+    problems = []
+    for shard in range(shard_count):
+        path_to_manifest = jobs_io.path_to_manifest(path_to_out_dir, shard, shard_count)
+        if not os.path.isfile(path_to_manifest):
+            problems.append("the manifest " + path_to_manifest + " is missing"
+                            + (" (unfinished)" if os.path.isfile(path_to_manifest + jobs_io.PARTIAL_SUFFIX) else ""))
+    if jobs_io.read_complete_manifests(path_to_out_dir) is None:
+        problems.append("the manifests don't cover all jobs")
+    return problems
+
+
+def main():
+    """run producer -> fake MONICA worker -> consumer locally against a synthetic archive
+    and report the throughput, the message sizes and the peak memory of the processes,
+    exit with 1 if the run went wrong (e.g. a worker process lost its manifest),
+    e.g. shards=2 runs two producers as separate processes like on two machines sharing the output dir"""
+
+    config = {
+        "bench-dir": "bench/",
+        "sites": "400",
+        "producer-port": "16666",
+        "consumer-port": "17777",
+        "delay": "0",
+        "workers": "1",
+        "shards": "1", # start this many producers (shard=i/n) as separate processes, each with workers worker processes
+        "shard-start-delay": "2", # seconds between the starts of the shards' producers
+        "parsers": "0",
+        "output-format": "csv",
+        "user": "stella",
+        "max-in-flight": "0", # > 0 run the producer with flow control by the consumer's acknowledgements
+        "ack-port": "17800",
+        "max-rate": "0",
+        "drop-rate": "0", # the fraction of envs the fake worker loses
+        "redispatch-factor": "0", # > 0 run the producer with redispatching of lost jobs, needs the acknowledgements
+        "redispatch-min-seconds": "60",
+        "climate": "path" # the producer's climate mode, for inline the archive's climate cubes are packed first
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    path_to_bench_dir = os.path.abspath(config["bench-dir"]) + "/"
+    path_to_archive = path_to_bench_dir + "archive-" + config["sites"] + "/"
+    path_to_run_dir = path_to_bench_dir + "run/"
+    path_to_climate_cubes = path_to_archive + "climate-cubes/"
+
+    if not os.path.isdir(path_to_archive):
+        subprocess.check_call([sys.executable, PATH_TO_REPOSITORY + "create-synthetic-archive.py",
+                               "path-to-archive=" + path_to_archive, "sites=" + config["sites"]])
+    if config["climate"] == "inline" and not os.path.isdir(path_to_climate_cubes):
+        subprocess.check_call([sys.executable, PATH_TO_REPOSITORY + "convert-climate.py",
+                               "path-to-climate-dir=" + path_to_archive + "climate/ipsl-cm5a-lr/",
+                               "path-to-cube-dir=" + path_to_climate_cubes])
+
+    # the producer reads sim.json, site.json and crop.json from the working dir, producer and consumer write to its out/
+    if os.path.isdir(path_to_run_dir):
+        shutil.rmtree(path_to_run_dir)
+    os.makedirs(path_to_run_dir)
+    for filename in ["sim.json", "site.json", "crop.json"]:
+        shutil.copy(PATH_TO_REPOSITORY + filename, path_to_run_dir)
+
+    def start(script, *args):
+        return subprocess.Popen([sys.executable, PATH_TO_REPOSITORY + script] + list(args), cwd=path_to_run_dir)
+
+    flow_control_args = []
+    if int(config["max-in-flight"]) > 0 or float(config["redispatch-factor"]) > 0:
+        flow_control_args = ["max-in-flight=" + config["max-in-flight"], "ack-server=localhost:" + config["ack-port"],
+                             "redispatch-factor=" + config["redispatch-factor"],
+                             "redispatch-min-seconds=" + config["redispatch-min-seconds"]]
+
+    worker = start("fake-monica-worker.py", "producer-port=" + config["producer-port"],
+                   "consumer-port=" + config["consumer-port"], "delay=" + config["delay"],
+                   "drop-rate=" + config["drop-rate"])
+    consumer = start("run-work-consumer.py", "server=localhost", "port=" + config["consumer-port"],
+                     "user=" + config["user"], "parsers=" + config["parsers"], "output-format=" + config["output-format"],
+                     *(["ack-port=" + config["ack-port"]] if flow_control_args else []))
+    start_run = time.time()
+    shard_count = int(config["shards"])
+    producers = []
+    for shard in range(shard_count):
+        if shard > 0:
+            time.sleep(float(config["shard-start-delay"]))
+        producers.append(start("run-work-producer.py", "server=localhost", "port=" + config["producer-port"],
+                               "user=" + config["user"], "archive=" + path_to_archive, "workers=" + config["workers"],
+                               "shard=" + str(shard) + "/" + str(shard_count),
+                               "cache-dir=" + path_to_bench_dir + "cache-" + config["sites"] + "/", 
+                               "max-rate=" + config["max-rate"], "climate=" + config["climate"],
+                               "path-to-climate-cubes=" + path_to_climate_cubes, *flow_control_args))
+
+    peak_rss = {}
+    problems = []
+    for shard, producer in enumerate(producers):
+        name = "producer" if shard_count == 1 else "producer-" + str(shard)
+        peak_rss[name] = wait_for(producer)
+        if producer.returncode != 0:
+            problems.append("the producer of shard " + str(shard) + "/" + str(shard_count) + " failed")
+    if problems:
+        # it would wait for the failed producer's jobs forever
+        consumer.send_signal(signal.SIGINT)
+    peak_rss["consumer"] = wait_for(consumer)
+    seconds = time.time() - start_run
+    worker.send_signal(signal.SIGINT)
+    peak_rss["worker"] = wait_for(worker)
+
+    path_to_metrics_dir = path_to_run_dir + "out/metrics/"
+    sent = read_metrics(path_to_metrics_dir, "producer-")
+    received = read_metrics(path_to_metrics_dir, "consumer")
+    report = {
+        "time": datetime.now().isoformat(),
+        "config": config,
+        "envs": sent["messages"],
+        "seconds": seconds,
+        "envs-per-sec": sent["messages"] / seconds,
+        "producer-envs-per-sec": sent["messages"] / max(sent["seconds"], 1e-9),
+        "consumer-results-per-sec": received["messages"] / max(received["seconds"], 1e-9),
+        "bytes-per-env": sent["bytes"] / max(sent["messages"], 1),
+        "bytes-per-result": received["bytes"] / max(received["messages"], 1),
+        "peak-rss-mb": peak_rss,
+        "problems": problems + check_manifests(path_to_run_dir + "out/", shard_count * int(config["workers"]))
+    }
+
+    print "envs:", report["envs"], "in", round(seconds, 2), "seconds ->", round(report["envs-per-sec"], 1), "envs/s"
+    print "producer:", round(report["producer-envs-per-sec"], 1), "envs/s,", report["bytes-per-env"], "bytes/env"
+    print "consumer:", round(report["consumer-results-per-sec"], 1), "results/s,", report["bytes-per-result"], "bytes/result"
+    print "peak rss (MB):", ", ".join(name + " " + str(round(mb, 1)) for name, mb in sorted(peak_rss.items()))
+
+    for problem in report["problems"]:
+        print "problem:", problem
+
+    # one line per run, to compare the numbers of successive changes
+    with open(path_to_bench_dir + "benchmarks.jsonl", "a") as _:
+        _.write(json.dumps(report) + "\n")
+    if report["problems"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
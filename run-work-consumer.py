@@ -18,16 +18,28 @@
 
 import sys
 
-#import json
+import json
 import csv
-import types
-import os
+import multiprocessing
+import Queue
+import signal
+import threading
+import time
+from collections import deque
 from datetime import datetime, date, timedelta
-from collections import defaultdict
 
 import zmq
 #print zmq.pyzmq_version()
 import monica_io
+import flow_control
+import job_costs
+import jobs_io
+import output_writers
+import result_aggregates
+import results_io
+import run_metrics
+import spool_io
+import wire_format
 import re
 import numpy as np
 
@@ -48,99 +60,195 @@ PATHS = {
     }
 }
 
-def create_output(result, lat, lon, elevation):
-    "create output structure for single run"
+def write_normal_output_file(result):
+    "write the complete result of a single run to its own file"
 
-    year_to_vals = defaultdict(dict)
-    out = []
-    if len(result.get("data", [])) > 0 and len(result["data"][0].get("results", [])) > 0:
+    custom_id = result["customId"]
+    ci_parts = custom_id.split("|")
+    cultivar = ci_parts[0]
+    lat = ci_parts[1]
+    lon = ci_parts[2]
 
-        for data in result.get("data", []):
-            results = data.get("results", [])
-            oids = data.get("outputIds", [])
-
-            #skip empty results, e.g. when event condition haven't been met
-            if len(results) == 0:
+    #with open("out/out-" + str(i) + ".csv", 'wb') as _:
+    with open("out/" + cultivar + "_lat_" + lat + "_lon_" + lon + ".csv", 'wb') as _:
+        writer = csv.writer(_, delimiter=",")
+    
+        for data_ in result.get("data", []):
+            results = data_.get("results", [])
+            orig_spec = data_.get("origSpec", "")
+            output_ids = data_.get("outputIds", [])
+
+            if len(results) > 0:
+                writer.writerow([orig_spec.replace("\"", "")])
+                for row in monica_io.write_output_header_rows(output_ids,
+                                                            include_header_row=True,
+                                                            include_units_row=True,
+                                                            include_time_agg=False):
+                    writer.writerow(row)
+
+                for row in monica_io.write_output(output_ids, results):
+                    writer.writerow(row)
+
+            writer.writerow([])
+
+
+def ignore_interrupt():
+    "let only the main process handle ctrl-c, the parser processes are terminated by it"
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+# the number of messages processed by all parser processes, shared by init_parser
+parsed_count = None
+
+
+def init_parser(shared_parsed_count):
+    global parsed_count
+    ignore_interrupt()
+    parsed_count = shared_parsed_count
+
+
+def parse_message(msg):
+    "process a message in a parser process and count it"
+    processed = results_io.process_message(msg)
+    with parsed_count.get_lock():
+        parsed_count.value += 1
+    return processed
+
+
+def receive_pipelined(sockets, parser_count, max_in_flight, handle_result, handle_idle, metrics, stats_interval=10.0):
+    """receive raw messages from the sockets in a thread, decode and process them in parser_count processes
+    and hand the results in order of arrival to handle_result,
+    until a finish message arrived from every socket or handle_idle returns True"""
+
+    received = Queue.Queue()
+    # bounds the messages between receiving and writing, so neither a slow writer nor slow parsers
+    # let the messages pile up in memory, instead they stay queued in zeromq
+    in_flight = threading.BoundedSemaphore(max_in_flight)
+    stop = threading.Event()
+    counts = {"received": 0, "written": 0, "finished": 0}
+    # sizes of the received messages, in the same order as the results of the parsers
+    sizes = deque()
+
+    def receive():
+        poller = zmq.Poller()
+        for socket in sockets:
+            poller.register(socket, zmq.POLLIN)
+        while not stop.is_set():
+            for socket, _ in poller.poll(1000):
+                while not in_flight.acquire(False):
+                    if stop.is_set():
+                        return
+                    time.sleep(0.01)
+                start_receive = time.time()
+                msg = socket.recv()
+                metrics.add_stage_time("receive", time.time() - start_receive)
+                sizes.append(len(msg))
+                received.put(msg)
+                counts["received"] += 1
+
+    def messages():
+        while not stop.is_set():
+            try:
+                yield received.get(timeout=1)
+            except Queue.Empty:
                 continue
 
-            assert len(oids) == len(results)
-            for kkk in range(0, len(results[0])):
-                vals = {}
-
-                for iii in range(0, len(oids)):
-                    oid = oids[iii]
-                    val = results[iii][kkk]
-
-                    name = oid["name"] if len(oid["displayName"]) == 0 else oid["displayName"]
-
-                    if isinstance(val, types.ListType):
-                        for val_ in val:
-                            vals[name] = val_
-                    else:
-                        vals[name] = val
-
-                year_to_vals[vals["Year"]].update(vals)
-
-    for year in sorted(year_to_vals):
-        vals = year_to_vals[year]
-
-        out.append([
-            lat,
-            lon,
-            elevation,
-            vals.get("Year", "NA"),
-            vals.get("sow-doy", "NA"),
-            vals.get("em-doy", "NA"),
-            vals.get("flow-doy", "NA"),
-            vals.get("mat-doy", "NA"),
-            vals.get("harv-doy", "NA"),
-            vals.get("harv-stage", "NA"),
-            vals.get("Tavg", "NA"),
-            vals.get("yield", "NA"),
-            vals.get("abbiom-harv", "NA"),
-            vals.get("LAImax", "NA"),
-            vals.get("applied-N", "NA"),
-            vals.get("N-leaching", "NA"),
-            vals.get("N-uptake", "NA"),
-            vals.get("cycle-length", "NA"),
-            vals.get("precip-sum", "NA"),
-            vals.get("TraDefavg", "NA"),
-            vals.get("TraDef1", "NA"),
-            vals.get("TraDef2", "NA"),
-            vals.get("TraDef3", "NA"),
-            vals.get("TraDef4", "NA"),
-            vals.get("TraDef5", "NA"),
-            vals.get("TraDef6", "NA"),
-            vals.get("TraDef7", "NA"),
-            vals.get("act-transp", "NA"),
-            vals.get("act-ET", "NA"),
-            vals.get("NDefavg", "NA"),
-            vals.get("NDef1", "NA"),
-            vals.get("NDef2", "NA"),
-            vals.get("NDef3", "NA"),
-            vals.get("NDef4", "NA"),
-            vals.get("NDef5", "NA"),
-            vals.get("NDef6", "NA"),
-            vals.get("NDef7", "NA")
-        ])
-
-    return out
-
-def write_data(path_to_out_dir, rows, cultivar, rcp, sowing, fertilizer, cycle_length):
-    "write data"
-
-    sowing_shortcut = "-".join(map(lambda x: x[:3], sowing.split("/")))
-    path_to_file = path_to_out_dir + cultivar + "_" + rcp + "_s-" + sowing_shortcut \
-    + "_f-" + fertilizer + "_c-" + cycle_length[:3] + ".csv"
-
-    if not os.path.isfile(path_to_file):
-        with open(path_to_file, "w") as _:
-            _.write("lat, lon, elevation, year, sow-doy, em-doy, flow-doy, mat-doy, harv-doy, harv-stage, crop-Tavg, yield, abbiom-harv, LAImax, applied-N, N-leaching, N-uptake, cycle-length, precip-sum, TraDefavg, TraDef1, TraDef2, TraDef3, TraDef4, TraDef5, TraDef6, TraDef7, act-transp, act-ET, NDefavg, NDef1, NDef2, NDef3, NDef4, NDef5, NDef6, NDef7\n")
-
-    with open(path_to_file, 'ab') as _:
-        writer = csv.writer(_, delimiter=",")
-        for row in rows:
-            writer.writerow(row)
+    receiver = threading.Thread(target=receive)
+    receiver.daemon = True
+    receiver.start()
+
+    shared_parsed_count = multiprocessing.Value("L", 0)
+    pool = multiprocessing.Pool(parser_count, initializer=init_parser, initargs=(shared_parsed_count,))
+    results = pool.imap(parse_message, messages())
+    last_stats = time.time()
+    try:
+        while True:
+            if time.time() - last_stats > stats_interval and counts["received"] > 0:
+                # many messages in the parsers and few parsed ones means the parsers are the bottleneck,
+                # many parsed ones waiting means the writer is
+                parsed = shared_parsed_count.value - counts["written"]
+                print "pipeline: received", counts["received"], \
+                "| in parsers", counts["received"] - counts["written"] - parsed, \
+                "| waiting for writer", parsed, "| written", counts["written"]
+                last_stats = time.time()
+
+            start_wait = time.time()
+            try:
+                kind, processed, timings = results.next(timeout=1)
+            except multiprocessing.TimeoutError:
+                metrics.add_stage_time("idle", time.time() - start_wait)
+                if handle_idle():
+                    break
+                continue
+            metrics.add_stage_time("idle", time.time() - start_wait)
+
+            counts["written"] += 1
+            in_flight.release()
+            size = sizes.popleft()
+            for stage, seconds in timings.iteritems():
+                metrics.add_stage_time(stage, seconds)
+            if kind == "finish":
+                counts["finished"] += 1
+                print "received finish message", counts["finished"], "of", len(sockets)
+                if counts["finished"] == len(sockets):
+                    break
+            else:
+                metrics.count_message(size)
+                if handle_result(*processed):
+                    break
+    finally:
+        stop.set()
+        pool.terminate()
+        receiver.join()
+
+
+def replay_spool(path_to_spool, parser_count, max_in_flight, handle_result, metrics):
+    """process the messages of a spool written by flush-queue.py as if they had been received,
+    in parser_count processes if > 0, until the end of the spool or handle_result returns True"""
+
+    # sizes of the read messages, in the same order as the results
+    sizes = deque()
+    pool = None
+    if parser_count > 0:
+        # bounds the messages read ahead of the writer
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+        stop = threading.Event()
+
+        def messages():
+            for msg in spool_io.read_frames(path_to_spool):
+                while not in_flight.acquire(False):
+                    if stop.is_set():
+                        return
+                    time.sleep(0.01)
+                sizes.append(len(msg))
+                yield msg
+
+        pool = multiprocessing.Pool(parser_count, initializer=ignore_interrupt)
+        results = pool.imap(results_io.process_message, messages(), chunksize=16)
+    else:
+        def process():
+            for msg in spool_io.read_frames(path_to_spool):
+                sizes.append(len(msg))
+                yield results_io.process_message(msg)
+
+        results = process()
+
+    try:
+        for kind, processed, timings in results:
+            if pool:
+                in_flight.release()
+            size = sizes.popleft()
+            for stage, seconds in timings.iteritems():
+                metrics.add_stage_time(stage, seconds)
+            # finish messages are meaningless without the producers they came from
+            if kind == "result":
+                metrics.count_message(size)
+                if handle_result(*processed):
+                    break
+    finally:
+        if pool:
+            stop.set()
+            pool.terminate()
 
 
 def main():
@@ -148,8 +256,22 @@ def main():
 
     config = {
         "port": "7777",
-        "server": "cluster1", 
-        "user": "stella"
+        "server": "cluster1", # several comma separated servers (optionally as server:port) are received from at once
+        "user": "stella",
+        "max-open-files": "64",
+        "checkpoint-interval": "30",
+        # wait for the jobs of the manifests of this run (see the producer's run-id), default the newest manifest's run
+        "run-id": "",
+        "output-format": "csv",
+        "parsers": "0", # > 0 receive, parse and write in a pipeline with this many parser processes
+        "max-in-flight": "200",
+        "verbose": "false", # print every received result
+        "ack-port": "", # publish the ids of the written jobs on this port for the producers' flow control
+        "aggregate-levels": "scenario,band", # comma separated levels of result_aggregates.LEVELS, empty for none
+        "aggregate-metrics": ",".join(result_aggregates.METRICS),
+        "replay": "", # process the messages spooled by flush-queue.py to this file instead of receiving
+        "cost-window": "60", # record the job costs for the producer's order=cost in windows of this many seconds
+        "wire-dictionaries": "" # comma separated dictionaries of compressed results (see wire_format.py)
     }
     if len(sys.argv) > 1:
         for arg in sys.argv[1:]:
@@ -158,78 +280,286 @@ def main():
                 config[k] = v 
 
     paths = PATHS[config["user"]]
+    # before the parser processes are forked
+    wire_format.load_dictionaries(path for path in config["wire-dictionaries"].split(",") if path)
 
     write_normal_output_files = False
+    parser_count = int(config["parsers"])
+    verbose = config["verbose"] == "true"
     
-    received_envs_count = 0
+    counts = {"received": 0, "duplicates": 0, "fanned-out": 0, "finished": 0}
+    # e.g. the results of jobs redispatched by the producer arriving a second time
+    duplicate_job_ids = []
     context = zmq.Context()
-    socket = context.socket(zmq.PULL)
-    socket.connect("tcp://" + config["server"] + ":" + config["port"])    
-    socket.RCVTIMEO = 10000
+    sockets = []
+    for server in config["server"].split(","):
+        socket = context.socket(zmq.PULL)
+        socket.connect("tcp://" + (server if ":" in server else server + ":" + config["port"]))
+        sockets.append(socket)
     leave = False
-    
-    while not leave:
-        try:
-            result = socket.recv_json(encoding="latin-1")
-        except:
-            continue
-
-        if result["type"] == "finish":
-            print "received finish message"
+
+    acks = flow_control.AckPublisher(context, config["ack-port"]) if config["ack-port"] else None
+
+    # ids of the jobs of the run whose results have already been written, also by earlier (interrupted) consumers
+    ledger = jobs_io.Ledger(jobs_io.path_to_ledger(paths["local-path-to-output-dir"]))
+
+    # the run whose results are received, the ledger's as long as there are manifests of it, otherwise the one
+    # of the newest manifest, read again whenever a manifest is created or removed, at least every second,
+    # and the customIds of its jobs, followed in its manifests once they are needed
+    run = {"id": None, "last-check": 0, "changed": None, "manifests": None, "ignored": set()}
+
+    # ids of the jobs of the producers' manifests of the run whose results are still missing,
+    # None as long as not all producers of the run have finished their manifests,
+    # read again whenever the finished manifests or the run (the one of the newest manifest by default) change
+    outstanding = {"job-ids": None, "last-check": 0, "signature": None}
+
+    def all_jobs_done():
+        "return True when the result of every job in the manifests of the run has been written"
+        if time.time() - outstanding["last-check"] > 1:
+            outstanding["last-check"] = time.time()
+            path_to_out_dir = paths["local-path-to-output-dir"]
+            run_id = sync_run()
+            signature = (run_id, jobs_io.manifests_signature(path_to_out_dir))
+            if signature != outstanding["signature"]:
+                is_startup = outstanding["signature"] is None
+                outstanding["signature"] = signature
+                # all manifests if they don't name a run (written by an older producer)
+                job_id_to_custom_id = jobs_io.read_complete_manifests(path_to_out_dir, run_id)
+                outstanding["job-ids"] = None
+                if job_id_to_custom_id is not None:
+                    job_ids = set(job_id_to_custom_id.iterkeys()) - ledger.done
+                    if is_startup and not job_ids and not config["run-id"]:
+                        # most likely left by an earlier run, a new one starts by changing the manifests
+                        print "all jobs of the manifests of run", run_id, "are done, waiting for the manifests to change"
+                    else:
+                        outstanding["job-ids"] = job_ids
+                        print "expecting", len(job_id_to_custom_id), "jobs" + (" of run " + run_id if run_id else "") + ",", \
+                        len(job_ids), "outstanding"
+        return outstanding["job-ids"] is not None and len(outstanding["job-ids"]) == 0
+
+    metrics = run_metrics.RunMetrics("received", 
+                                     remaining=lambda: None if outstanding["job-ids"] is None else len(outstanding["job-ids"]))
+
+    if config["output-format"] == "npy":
+        writer_pool = output_writers.ColumnarWriterPool(paths["local-path-to-output-dir"] + "columns/",
+                                                        checkpoint_interval=float(config["checkpoint-interval"]))
+    else:
+        writer_pool = output_writers.CsvWriterPool(paths["local-path-to-output-dir"],
+                                                   max_open_files=int(config["max-open-files"]),
+                                                   checkpoint_interval=float(config["checkpoint-interval"]))
+    # rows written after the last checkpoint belong to jobs not recorded as done, they are received again
+    writer_pool.restore(ledger.state)
+
+    aggregates = None
+    if len(config["aggregate-levels"]) > 0:
+        aggregates = result_aggregates.ResultAggregates(paths["local-path-to-output-dir"] + "aggregates/",
+                                                        metrics=config["aggregate-metrics"].split(","),
+                                                        levels=config["aggregate-levels"].split(","))
+        # so are the jobs aggregated after the last checkpoint
+        aggregates.restore(ledger.state)
+        if aggregates.jobs != len(ledger.done):
+            # e.g. aggregated by a consumer without aggregates or one of an older version
+            print "warning: the aggregates cover", aggregates.jobs, "jobs, but", len(ledger.done), "jobs are done"
+
+    def output_state():
+        "return the ledger's state with the state of the output the jobs recorded as done have been written to"
+        state = dict(ledger.state, **writer_pool.state())
+        if aggregates:
+            state.update(aggregates.state())
+        return state
+
+    ledger.flush(output_state())
+
+    # replayed results arrive at disk speed, not at the speed of the cluster
+    costs = job_costs.CostRecorder(job_costs.path_to_cost_history(paths["local-path-to-output-dir"]),
+                                   window=float(config["cost-window"])) if not config["replay"] else None
+    # the costs are recorded with the features the producer estimated them from
+    cost_features = jobs_io.ManifestFollower(paths["local-path-to-output-dir"], skip=ledger.done) if costs else None
+
+    def checkpoint():
+        "make the written rows and the aggregates durable and only then record their jobs as done"
+        writer_pool.checkpoint()
+        if aggregates:
+            aggregates.checkpoint()
+        ledger.flush(output_state())
+
+    def sync_run():
+        """return the id of the run whose results are received, if it isn't the ledger's start the ledger
+        and the aggregates again, the jobs done in another run are other jobs than this run's with the same ids,
+        the ledger's run ends only when its manifests have been removed (see the producer's remove-stale-manifests)"""
+        path_to_out_dir = paths["local-path-to-output-dir"]
+        if not config["run-id"]:
+            changed = jobs_io.manifests_changed_time(path_to_out_dir)
+            if changed != run["changed"] or time.time() - run["last-check"] > 1:
+                run["changed"] = changed
+                run["last-check"] = time.time()
+                run_id = jobs_io.read_newest_run_id(path_to_out_dir)
+                if run_id != ledger.run_id and ledger.run_id is not None and ledger.done \
+                and jobs_io.list_manifests(path_to_out_dir, include_partial=True, run_id=ledger.run_id):
+                    # e.g. a shard started with another run-id next to the shards of the ledger's run
+                    if run_id not in run["ignored"]:
+                        run["ignored"].add(run_id)
+                        print "ignoring the manifests of run", run_id, "while there are manifests of run", \
+                        ledger.run_id, "whose jobs are in the ledger"
+                    run_id = ledger.run_id
+                run["id"] = run_id
+        run_id = config["run-id"] or run["id"]
+        if run_id is not None and run_id != ledger.run_id:
+            checkpoint()
+            print "starting the ledger of run", run_id + ",", len(ledger.done), "jobs of", \
+            ("run " + ledger.run_id if ledger.run_id else "an earlier run"), "aren't done in it"
+            if aggregates:
+                aggregates.reset()
+            ledger.start_run(run_id, output_state())
+            if cost_features:
+                cost_features.skip = ledger.done
+            run["manifests"] = None
+            outstanding["job-ids"] = None
+            outstanding["last-check"] = 0
+        return run_id
+
+    def is_done(job_id, custom_id):
+        """return True if the result of the job has already been written in this run,
+        checked against the customId of the job in the run's manifests, whose new rows are read whenever
+        the job isn't known yet, so a job resent e.g. by a restarted producer is known before it is written"""
+        if job_id not in ledger:
+            return False
+        if run["manifests"] is None:
+            run["manifests"] = jobs_io.ManifestFollower(paths["local-path-to-output-dir"], min_interval=0,
+                                                        run_id=ledger.run_id, with_custom_id=True)
+        fields = run["manifests"].get(job_id)
+        return fields is not None and fields[0] == custom_id
+
+    def write_job(job_id, name, rows):
+        "write the rows of a job and record it as done"
+        writer_pool.write_rows(name, rows)
+        if aggregates:
+            with metrics.stage("aggregate"):
+                aggregates.add_rows(name, rows)
+        if job_id is not None:
+            ledger.record(job_id)
+            if outstanding["job-ids"] is not None:
+                outstanding["job-ids"].discard(job_id)
+
+    def handle_result(custom_id, job_id, name, rows, duplicates):
+        """write the rows of a result unless its job has already been written and the rows of the jobs deduplicated
+        into it, return True when all jobs are done"""
+        if acks and job_id is not None:
+            acks.ack(job_id)
+
+        sync_run()
+        if job_id is not None and is_done(job_id, custom_id):
+            if verbose:
+                print "skipping already written result of job", job_id
+            counts["duplicates"] += 1
+            duplicate_job_ids.append(job_id)
+            return False
+
+        start_write = time.time()
+        if verbose:
+            print "received work result", counts["received"], "customId:", custom_id
+        write_job(job_id, name, rows)
+        if costs:
+            features = cost_features.pop(job_id) if job_id is not None else None
+            if features and len(features) >= 2:
+                costs.add(int(features[0]), int(features[1]))
+            else:
+                costs.add_unknown()
+        for duplicate_job_id, duplicate_rows in duplicates:
+            if cost_features:
+                cost_features.discard(duplicate_job_id)
+            if duplicate_job_id not in ledger:
+                write_job(duplicate_job_id, name, duplicate_rows)
+                counts["fanned-out"] += 1
+        counts["received"] += 1
+
+        if writer_pool.is_checkpoint_due():
+            checkpoint()
+        metrics.add_stage_time("write", time.time() - start_write)
+        return all_jobs_done()
+
+    def handle_idle():
+        "return True when all jobs are done"
+        if acks:
+            acks.flush_if_due()
+        if writer_pool.is_checkpoint_due():
+            checkpoint()
+        return all_jobs_done()
+
+    poller = zmq.Poller()
+    for socket in sockets:
+        poller.register(socket, zmq.POLLIN)
+
+    try:
+        leave = all_jobs_done()
+        if config["replay"] and not leave:
+            replay_spool(config["replay"], parser_count, int(config["max-in-flight"]), handle_result, metrics)
             leave = True
 
-        elif not write_normal_output_files:
-            custom_id = result["customId"]
-            ci_parts = custom_id.split("|")
-            cultivar = ci_parts[0]
-            lat = ci_parts[1]
-            lon = ci_parts[2]
-            rcp = ci_parts[3]
-            sowing = ci_parts[4]
-            fertilizer = ci_parts[5]
-            cycle_length = ci_parts[6]
-            elevation = ci_parts[7]
-
-            print "received work result", received_envs_count, "customId:", result.get("customId", "")
-
-            out = create_output(result, lat, lon, elevation)
-            write_data(paths["local-path-to-output-dir"], out, cultivar, rcp, sowing, fertilizer, cycle_length)
-
-            received_envs_count = received_envs_count + 1
-        
-        elif write_normal_output_files:
-            print "received work result ", received_envs_count, " customId: ", result.get("customId", "")
-
-            custom_id = result["customId"]
-            ci_parts = custom_id.split("|")
-            cultivar = ci_parts[0]
-            lat = ci_parts[1]
-            lon = ci_parts[2]
-
-            #with open("out/out-" + str(i) + ".csv", 'wb') as _:
-            with open("out/" + cultivar + "_lat_" + lat + "_lon_" + lon + ".csv", 'wb') as _:
-                writer = csv.writer(_, delimiter=",")
-                
-                for data_ in result.get("data", []):
-                    results = data_.get("results", [])
-                    orig_spec = data_.get("origSpec", "")
-                    output_ids = data_.get("outputIds", [])
-
-                    if len(results) > 0:
-                        writer.writerow([orig_spec.replace("\"", "")])
-                        for row in monica_io.write_output_header_rows(output_ids,
-                                                                    include_header_row=True,
-                                                                    include_units_row=True,
-                                                                    include_time_agg=False):
-                            writer.writerow(row)
-
-                        for row in monica_io.write_output(output_ids, results):
-                            writer.writerow(row)
-
-                    writer.writerow([])
-
-            received_envs_count = received_envs_count + 1
-
-main()
+        if parser_count > 0 and not write_normal_output_files and not leave:
+            receive_pipelined(sockets, parser_count, int(config["max-in-flight"]), handle_result, handle_idle, metrics)
+            leave = True
+
+        while not leave:
+            start_wait = time.time()
+            ready_sockets = poller.poll(1000)
+            metrics.add_stage_time("idle", time.time() - start_wait)
+            if not ready_sockets:
+                leave = handle_idle()
+                continue
+
+            for socket, _ in ready_sockets:
+                with metrics.stage("receive"):
+                    msg = socket.recv()
+
+                if write_normal_output_files:
+                    result = json.loads(wire_format.decode(msg), encoding="latin-1")
+                    kind = result["type"]
+                else:
+                    kind, processed, timings = results_io.process_message(msg)
+                    for stage, seconds in timings.iteritems():
+                        metrics.add_stage_time(stage, seconds)
+
+                if kind == "finish":
+                    counts["finished"] += 1
+                    print "received finish message", counts["finished"], "of", len(sockets)
+                    leave = counts["finished"] == len(sockets)
+
+                elif not write_normal_output_files:
+                    metrics.count_message(len(msg))
+                    leave = handle_result(*processed)
+            
+                elif write_normal_output_files:
+                    print "received work result ", counts["received"], " customId: ", result.get("customId", "")
+                    write_normal_output_file(result)
+                    counts["received"] += 1
+
+                if leave:
+                    break
+
+    except KeyboardInterrupt:
+        print "interrupted, writing buffered results"
+
+    checkpoint()
+    writer_pool.close()
+    ledger.close()
+    if costs:
+        costs.close()
+    if acks:
+        acks.close()
+    print "received", counts["received"], "results,", counts["duplicates"], "duplicates skipped"
+    if counts["fanned-out"] > 0:
+        print "wrote", counts["fanned-out"], "results of deduplicated jobs"
+    metrics.report()
+    stage_seconds = {stage: seconds for stage, (seconds, _) in metrics.stages.iteritems()}
+    print "waited", round(stage_seconds.get("idle", 0), 1), "seconds for results, wrote them in", \
+    round(stage_seconds.get("write", 0), 1), "seconds"
+    metrics.write_json(run_metrics.path_to_metrics(paths["local-path-to-output-dir"], "consumer"),
+                       results=counts["received"], duplicates=counts["duplicates"],
+                       fanned_out=counts["fanned-out"], duplicate_job_ids=duplicate_job_ids)
+
+
+if __name__ == "__main__":
+    main()
 
 
@@ -16,20 +16,33 @@
 # Landscape Systems Analysis at the ZALF.
 # Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
 
-import csv
+import hashlib
 import json
 import os
+import subprocess
 import sys
 import time
 import zmq
 import copy
 import monica_io
+import array_cache
+import climate_cube
+import csv_io
+import env_builder
+import flow_control
+import job_costs
+import job_space
+import jobs_io
+import results_io
+import run_metrics
+import soil_store
+import spatial_index
+import wire_format
 import soil_io
 import ascii_io
 from datetime import date, timedelta
 import numpy as np
-from collections import defaultdict
-from scipy.interpolate import NearestNDInterpolator
+from collections import defaultdict, OrderedDict
 from pyproj import Proj, transform
 
 
@@ -38,29 +51,75 @@ PATHS = {
         "include-file-base-path": "C:/Users/fikadu/Documents/GitHub",
         "local-path-to-archive": "Z:/data/ethiopia/",
         "local-path-to-repository": "C:/Users/fikadu/Documents/GitHub/ethiopia-cc-impact/",
-        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/"
+        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/",
+        "local-path-to-output-dir": "out/"
     },
     "stella": {
         "include-file-base-path": "C:/Users/stella/Documents/GitHub",
         "local-path-to-archive": "Z:/data/ethiopia/",
         "local-path-to-repository": "C:/Users/stella/Documents/GitHub/ethiopia-cc-impact/",
-        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/"
+        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/",
+        "local-path-to-output-dir": "out/"
     },
     "berg-xps15": {
         "include-file-base-path": "C:/Users/berg.ZALF-AD/GitHub",
         "local-path-to-archive": "A:/data/ethiopia/",
         "local-path-to-repository": "C:/Users/berg.ZALF-AD/GitHub/ethiopia-cc-impact/",
-        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/"
+        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/",
+        "local-path-to-output-dir": "out/"
     },
     "berg-lc": {
         "include-file-base-path": "C:/Users/berg.ZALF-AD/GitHub",
         "local-path-to-archive": "A:/data/ethiopia/",
         "local-path-to-repository": "C:/Users/berg.ZALF-AD/GitHub/ethiopia-cc-impact/",
-        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/"
+        "cluster-path-to-archive": "/archiv-daten/md/data/ethiopia/",
+        "local-path-to-output-dir": "out/"
     }
 }
 
 
+# sowing dates ("0000-MM-DD") by onset day of year
+SOWING_DATES = [(date(2017, 1, 1) + timedelta(days=doy - 1)).strftime("0000-%m-%d") for doy in range(367)]
+
+SITE_DTYPE = np.dtype([
+    ("lat", np.float64),
+    ("lon", np.float64),
+    ("clat", np.float64),
+    ("clon", np.float64),
+    ("slope", np.float64),
+    ("elevation", np.float64),
+    ("band", np.int8),
+    # distance [m] to the farthest of the nearest crop land probability, slope and elevation data points
+    # and to the nearest climate data point
+    ("dist", np.float32),
+    ("cdist", np.float32)
+])
+
+# increase whenever the layout or the meaning of SITE_DTYPE's fields changes, to invalidate cached site tables
+SITE_TABLE_VERSION = 3
+
+def parse_shard(shard):
+    "parse 'i/n' into (i, n)"
+    i, n = map(int, shard.split("/"))
+    if not 0 <= i < n:
+        raise ValueError("shard " + shard + " is not in 0/n ... n-1/n")
+    return i, n
+
+def run_worker_processes(shard, shard_count, workers, worker_args=()):
+    """split shard into workers sub shards and send each by its own producer process (with worker_args),
+    sub shard j of shard i/n is the shard (i + n*j)/(n*workers)"""
+    worker_keys = ["shard", "workers"] + [arg.split("=")[0] for arg in worker_args]
+    args = [arg for arg in sys.argv[1:] if arg.split("=")[0] not in worker_keys] + list(worker_args)
+    processes = []
+    for worker in range(workers):
+        sub_shard = str(shard + shard_count * worker) + "/" + str(shard_count * workers)
+        processes.append((sub_shard, subprocess.Popen([sys.executable, sys.argv[0]] + args
+                                                      + ["shard=" + sub_shard, "workers=1"])))
+    for _, process in processes:
+        process.wait()
+    print "all", workers, "worker processes of shard", str(shard) + "/" + str(shard_count), "finished"
+
+
 def main():
     "main function"
 
@@ -68,7 +127,68 @@ def main():
         "port": "6666",
         "server": "cluster1",
         "user": "stella",
-        "local-paths": "false"
+        "local-paths": "false",
+        "use-cache": "true",
+        "cache-dir": "cache/",
+        "load-threads": "4", # the input files are loaded on this many threads
+        "max-distance": "inf", # [m] skip sites farther from the crop land probability, slope or elevation data
+        "max-climate-distance": "inf",
+        "shard": "0/1",
+        "workers": "1",
+        "resume": "false",
+        # the manifests and the consumer's ledger name the run they belong to, default a hash of the job space,
+        # the same for shards started separately, resume continues the newest manifest's run
+        "run-id": "",
+        # true: start a new run, the job space's hash and the start time as run-id, instead of continuing the ledger
+        # of the job space's run, the other shards need the printed run-id then
+        "new-run": "false",
+        # remove the finished manifests of other job spaces (with new-run also the ones of earlier runs of the same),
+        # false for the worker processes (see workers), their parent process removes them
+        "remove-stale-manifests": "true",
+        "verbose": "false", # print every sent env
+        "archive": "", # use this archive instead of the user's local-path-to-archive
+        "max-in-flight": "0", # > 0 send only while less of the shard's jobs are unacknowledged by the consumer
+        "ack-server": "", # server:port where the consumer publishes its acknowledgements (its ack-port)
+        "max-rate": "0", # > 0 send at most this many envs per second
+        # > 0 (needs ack-server) send jobs again which are unacknowledged for longer than this many times
+        # the 95th percentile of the acknowledgement latencies (but at least redispatch-min-seconds),
+        # e.g. because their worker crashed, and wait for all jobs to be acknowledged before exiting
+        "redispatch-factor": "0",
+        "redispatch-min-seconds": "60",
+        "max-redispatches": "2",
+        # jobs unacknowledged for longer than this many seconds are given up when not redispatching (see flow_control.py)
+        "ack-timeout": "300",
+        "send-hwm": "", # high water mark of the PUSH socket, zeromq's default (1000) if empty
+        "rotation-cache-size": "10000",
+        # path: MONICA reads the climate csv from the archive,
+        # inline: the climate csv is taken from the climate cubes (see convert-climate.py) and sent within the env,
+        # node-cache: MONICA reads the climate csv from node-cache-dir on its node (see convert-climate.py action=unpack)
+        "climate": "path",
+        "path-to-climate-cubes": "climate-cubes/",
+        "node-cache-dir": "/tmp/ethiopia-climate/",
+        "climate-cache-size": "64",
+        "dedup": "false", # simulate sites with identical inputs only once, the consumer writes the result for all of them
+        # > 0 sites whose latitudes are rounded to the same multiple of this (degrees) count as identical
+        "dedup-lat-tolerance": "0",
+        # filters of the job space, comma separated lists, empty for all
+        "rcps": "rcp2p6",
+        "sowings": "",
+        "fertilizers": "recommended",
+        "cycle-lengths": "standard",
+        "varieties": "meko",
+        "bbox": "", # min-lat,min-lon,max-lat,max-lon
+        "region": "", # path to a csv with the lat,lon vertices of a polygon
+        "bands": "", # indices into ELEVATION_BANDS (0: <1600, 1: 1600-1900, 2: >1900)
+        "sample": "1", # < 1 send only this fraction of the sites
+        "sample-mode": "random", # random or stratified (the fraction of each elevation band)
+        "seed": "0",
+        "count-only": "false", # just print the number of jobs matching the filters
+        # loop: scenario by scenario, cost: the most expensive jobs first, taking turns between the scenarios
+        "order": "loop",
+        "cost-history": "", # the job costs recorded by the consumer, default out/metrics/job-costs.csv
+        "wire-codec": "", # zlib or zstd: send the envs compressed (see wire_format.py), the workers need a wire-relay.py
+        "wire-dictionary": "", # compress with this dictionary (see create-wire-dictionary.py)
+        "wire-level": ""
     }
     if len(sys.argv) > 1:
         for arg in sys.argv[1:]:
@@ -76,12 +196,17 @@ def main():
             if k in config:
                 config[k] = v 
 
-    context = zmq.Context()
-    socket = context.socket(zmq.PUSH)
-    socket.connect("tcp://" + config["server"] + ":" + config["port"])
-    
     paths = PATHS[config["user"]]
+    if config["archive"]:
+        paths = dict(paths, **{"local-path-to-archive": config["archive"]})
     use_local_paths = config["local-paths"] == "true"
+    use_cache = config["use-cache"] == "true"
+    verbose = config["verbose"] == "true"
+    # the ETA is known once the number of jobs is
+    sent_envs = {"total": None}
+    metrics = run_metrics.RunMetrics("sent", remaining=lambda: None if sent_envs["total"] is None 
+                                     else sent_envs["total"] - metrics.messages)
+    start_prep = time.time()
 
     with open("sim.json") as _:
         sim = json.load(_)
@@ -94,119 +219,153 @@ def main():
 
     sim["include-file-base-path"] = paths["include-file-base-path"]
 
-    rcps = [
-        #"baseline",
-        "rcp2p6",
-        #"rcp4p5",
-        #"rcp6p0",
-        #"rcp8p5"
-    ]
+    # the whole job space, the filters select the jobs to be sent
+    rcps = ["baseline", "rcp2p6", "rcp4p5", "rcp6p0", "rcp8p5"]
 
-    sorghum_varieties = ["meko"]#, "teshale"]
+    sorghum_varieties = ["meko", "teshale"]
 
     wgs84 = Proj(init="epsg:4326")
     utm37n = Proj(init="epsg:20137")
 
-    def create_crop_probability_interpolator(path_to_csv_file, wgs84, utm37n):
-        "create interpolation object from some dir with climate data"
-        points = []
-        values = []
+    def read_crop_probabilities(path_to_csv_file):
+        "read crop land probabilities and project their coordinates"
+        lons, lats, values = csv_io.read_columns(path_to_csv_file, [5, 6, 7])
+        r, h = transform(wgs84, utm37n, lons, lats)
+        return {"points": np.column_stack((r, h)), "values": values}
 
-        with open(path_to_csv_file) as _:
-            reader = csv.reader(_)
-            reader.next()
-            for line in reader:
-                lon = float(line[5])
-                lat = float(line[6])
-                prob = float(line[7])
-
-                r, h = transform(wgs84, utm37n, lon, lat)
-                #xlon, xlat = transform(utm37n, wgs84, r, h)
-                points.append([r, h])
-                values.append(prob)
-
-        return NearestNDInterpolator(np.array(points), np.array(values))
-
-    interpol_crop_prob = create_crop_probability_interpolator(paths["local-path-to-archive"] + "Ethiopia_crop_land_prob.csv", wgs84, utm37n)
-
-    def create_climate_interpolator(path_to_climate_dir, scenario, wgs84, utm37n):
-        "create interpolation object from some dir with climate data"
-        points = []
-        values = []
+    def read_climate_cells(path_to_climate_dir, scenario):
+        "read climate cells (lat, lon) from some dir with climate data and project their coordinates"
+        lons = []
+        lats = []
         for filename in os.listdir(path_to_climate_dir + scenario + "/"):
             #if filename[:len(scenario)] != scenario:
             #    continue
 
             #parse from "baseline_3.25_33.25.csv"
             parts = filename.split("_")
-            lat = float(parts[1]) #float(parts[1].strip())
-            lon = float(parts[2][:-4]) #float(parts[2][:-4].strip())
+            lats.append(float(parts[1])) #float(parts[1].strip())
+            lons.append(float(parts[2][:-4])) #float(parts[2][:-4].strip())
 
-            r, h = transform(wgs84, utm37n, lon, lat)
-            #xlon, xlat = transform(utm37n, wgs84, r, h)
-            points.append([r, h])
-            values.append((lat, lon))
-            #print "lat:", lat, "lon:", lon, "h:", h, "r:", r, "val:", values[len(values)-1]
+        r, h = transform(wgs84, utm37n, np.array(lons), np.array(lats))
+        return {"points": np.column_stack((r, h)), "values": np.column_stack((lats, lons))}
 
-        return NearestNDInterpolator(np.array(points), np.array(values))
+    def read_soil_layers(path_to_soil_csv):
+        "read soil layers as rows of (lat, lon, Thickness, Sand, Clay, pH, FC, PWP, BD, SOC)"
+        return {"layers": np.column_stack(csv_io.read_columns(path_to_soil_csv, range(10))).reshape(-1, 10)}
 
-    
-    interpol_climate = create_climate_interpolator(paths["local-path-to-archive"] + "climate/ipsl-cm5a-lr/", "baseline", wgs84, utm37n)
-
-
-    def create_soil_profiles(path_to_soil_csv):
-        "load/create soil profiles"
-        with open(path_to_soil_csv) as _:
-            profiles = defaultdict(list)
-            reader = csv.reader(_, delimiter=",")
-            reader.next()
-            for line in reader:
-                profiles[(float(line[0]), float(line[1]))].append({
-                    "Thickness": float(line[2]),
-                    "Sand": float(line[3]),
-                    "Clay": float(line[4]),
-                    "pH": float(line[5]),
-                    "FieldCapacity": float(line[6]),
-                    "PermanentWiltingPoint": float(line[7]),
-                    "SoilBulkDensity": float(line[8]),
-                    "SoilOrganicCarbon": float(line[9])
-                })
-            return profiles
-
-    profiles = create_soil_profiles(paths["local-path-to-archive"] + "soil/soil.csv")
-
-    def create_slope_or_elevation_interpolator(path_to_csv):
-        "load slope or elevation data"
-        points = []
-        values = []
-        with open(path_to_csv) as _:
-            reader = csv.reader(_, delimiter=",")
-            reader.next()
-            for line in reader:
-                lon = float(line[0])
-                lat = float(line[1])
-                value = float(line[2])
-                r, h = transform(wgs84, utm37n, lon, lat)
-                #xlon, xlat = transform(utm37n, wgs84, r, h)
-                points.append([r, h])
-                values.append(value)
-                #print "lat:", lat, "lon:", lon, "h:", h, "r:", r, "val:", values[len(values)-1]
-
-        return NearestNDInterpolator(np.array(points), np.array(values))
-
-    interpol_slope = create_slope_or_elevation_interpolator(paths["local-path-to-archive"] + "slope/slope.csv")
-    interpol_elevation = create_slope_or_elevation_interpolator(paths["local-path-to-archive"] + "elevation/elevation.csv")
+    def read_slope_or_elevation(path_to_csv):
+        "read slope or elevation data and project their coordinates"
+        lons, lats, values = csv_io.read_columns(path_to_csv, [0, 1, 2])
+        r, h = transform(wgs84, utm37n, lons, lats)
+        return {"points": np.column_stack((r, h)), "values": values}
 
     def read_onset_dates(path_to_onset_dates_csv):
-        "load onset dates"
-        with open(path_to_onset_dates_csv) as _:
-            onsets = defaultdict(dict)
-            reader = csv.reader(_, delimiter=",")
-            reader.next()
-            for line in reader:
-                xxx, slat, slon = line[3].split(" _ ")
-                onsets[(float(slat), float(slon))][int(line[0])] = int(line[1])
-            return onsets
+        "load onset dates as climate cell (lat, lon) x year array of the onset's day of year, -1 for missing onsets"
+        # the cell column looks like "ons _ 8.25 _ 37.25"
+        years, onset_doys, lats, lons = csv_io.read_columns(path_to_onset_dates_csv, [0, 1, 4, 5],
+                                                            dtype=[np.int64, np.int64, np.float64, np.float64],
+                                                            extra_delimiters=[" _ "])
+        # the cells in the order of their first row
+        unique_cells, first_rows, cell_indices = np.unique(np.column_stack((lats, lons)), axis=0,
+                                                           return_index=True, return_inverse=True)
+        order = np.argsort(first_rows)
+        ranks = np.empty(len(order), dtype=np.int64)
+        ranks[order] = np.arange(len(order))
+        cell_indices = ranks[cell_indices]
+
+        first_year = years.min() if len(years) > 0 else 0
+        year_count = years.max() - first_year + 1 if len(years) > 0 else 0
+        doys = np.full((len(order), year_count), -1, dtype=np.int16)
+        doys[cell_indices, years - first_year] = onset_doys
+        cells = unique_cells[order].astype(np.float64).reshape(-1, 2)
+        return {"cells": cells, "doys": doys}
+
+    path_to_archive = paths["local-path-to-archive"]
+    path_to_crop_prob_csv = path_to_archive + "Ethiopia_crop_land_prob.csv"
+    path_to_climate_dir = path_to_archive + "climate/ipsl-cm5a-lr/"
+    path_to_soil_csv = path_to_archive + "soil/soil.csv"
+    path_to_slope_csv = path_to_archive + "slope/slope.csv"
+    path_to_elevation_csv = path_to_archive + "elevation/elevation.csv"
+
+    def cached(name, paths_to_sources, create_arrays, version=0):
+        "return arrays from the cache if enabled and up to date with the sources, else create them"
+        if not use_cache:
+            return create_arrays()
+        return array_cache.load_or_create(config["cache-dir"], name, paths_to_sources, create_arrays, version)
+
+    def path_to_onset_dates_csv(rcp):
+        return path_to_archive + "onset-dates/" + rcp + ".csv"
+
+    def load_onset_dates(rcp):
+        return cached("onsets-" + rcp, [path_to_onset_dates_csv(rcp)],
+                      lambda: read_onset_dates(path_to_onset_dates_csv(rcp)))
+
+    # the input files are independent of each other, on a network mount loading them at once saves most of the time
+    loads = OrderedDict([
+        # the layers of identical profiles are stored once, the layer dicts are created per env
+        ("soil", lambda: cached("soil-store", [path_to_soil_csv],
+                                lambda: soil_store.create_arrays(read_soil_layers(path_to_soil_csv)["layers"]))),
+        ("crop-prob", lambda: cached("crop-prob", [path_to_crop_prob_csv],
+                                     lambda: read_crop_probabilities(path_to_crop_prob_csv))),
+        ("climate-baseline", lambda: cached("climate-baseline", [path_to_climate_dir + "baseline/"],
+                                            lambda: read_climate_cells(path_to_climate_dir, "baseline"))),
+        ("slope", lambda: cached("slope", [path_to_slope_csv], lambda: read_slope_or_elevation(path_to_slope_csv))),
+        ("elevation", lambda: cached("elevation", [path_to_elevation_csv],
+                                     lambda: read_slope_or_elevation(path_to_elevation_csv)))
+    ])
+    for rcp in job_space.parse_list(config["rcps"]) or rcps:
+        loads["onsets-" + rcp] = lambda rcp=rcp: load_onset_dates(rcp)
+    inputs = csv_io.load_concurrently(loads, threads=int(config["load-threads"]), metrics=metrics)
+
+    soil = soil_store.SoilStore(inputs["soil"])
+
+    def create_site_table():
+        "project all soil profile coordinates at once and resolve the per site attributes of the gridded layers"
+        crop_prob = inputs["crop-prob"]
+        climate = inputs["climate-baseline"]
+        slope = inputs["slope"]
+        elevation = inputs["elevation"]
+
+        index = spatial_index.SpatialIndex()
+        index.add_layer("crop-prob", crop_prob["points"], crop_prob["values"])
+        index.add_layer("climate", climate["points"], climate["values"])
+        index.add_layer("slope", slope["points"], slope["values"])
+        index.add_layer("elevation", elevation["points"], elevation["values"])
+
+        coords = np.asarray(soil.coords, dtype=np.float64)
+        srs, shs = transform(wgs84, utm37n, coords[:, 1], coords[:, 0])
+        points = np.column_stack((srs, shs))
+
+        values, distances = index.query(points)
+        is_crop_land = values["crop-prob"] >= 40
+
+        sites = np.empty(np.count_nonzero(is_crop_land), dtype=SITE_DTYPE)
+        sites["lat"] = coords[is_crop_land, 0]
+        sites["lon"] = coords[is_crop_land, 1]
+        sites["clat"] = values["climate"][is_crop_land, 0]
+        sites["clon"] = values["climate"][is_crop_land, 1]
+        sites["slope"] = values["slope"][is_crop_land]
+        sites["elevation"] = values["elevation"][is_crop_land]
+        sites["band"] = results_io.elevation_band(sites["elevation"])
+        # every layer's distance is limited, the climate layer's by max-climate-distance, the others' by max-distance
+        sites["dist"] = np.max([distances[name] for name in ["crop-prob", "slope", "elevation"]], axis=0)[is_crop_land]
+        sites["cdist"] = distances["climate"][is_crop_land]
+        return {"sites": sites}
+
+    site_table = cached("sites", [path_to_soil_csv, path_to_crop_prob_csv, path_to_climate_dir + "baseline/",
+                                  path_to_slope_csv, path_to_elevation_csv],
+                        lambda: create_site_table(), version=SITE_TABLE_VERSION)["sites"]
+    is_near = (site_table["dist"] <= float(config["max-distance"])) \
+    & (site_table["cdist"] <= float(config["max-climate-distance"]))
+    if not is_near.all():
+        print "skipping", np.count_nonzero(~is_near), "sites too far from the nearest crop land probability, slope, elevation or climate data"
+        site_table = site_table[is_near]
+    metrics.add_stage_time("site-preparation", time.time() - start_prep)
+    print "prepared", len(site_table), "of", len(soil), "sites with", soil.profile_count(), "distinct soil profiles in", \
+    (time.time() - start_prep), "seconds"
+
+    shard, shard_count = parse_shard(config["shard"])
+    workers = int(config["workers"])
 
     env = monica_io.create_env_json_from_json_config({
         "crop": crop,
@@ -232,18 +391,18 @@ def main():
                     "calculated-onsets",
                     "recommended/avg-static-elevation-onsets"]:
         for n_fert in ["recommended",
-                        #"targetN"
-                        #"NDemand_20",
-                        #"NDemand_30",
-                        #"NDemand_40",
-                        #"NDemand_50",
-                        #"NDemand_60",
-                        #"NDemand_70",
-                        #"NDemand_80",
-                        #"NDemand_90",
-                        #"NDemand_100",
+                        "targetN",
+                        "NDemand_20",
+                        "NDemand_30",
+                        "NDemand_40",
+                        "NDemand_50",
+                        "NDemand_60",
+                        "NDemand_70",
+                        "NDemand_80",
+                        "NDemand_90",
+                        "NDemand_100",
                         ]:#, "auto"]:
-            for cycle_length in ["standard"]:#, "longer"]:
+            for cycle_length in ["standard", "longer"]:
                 adaptation_options.append({
                     "sowing": sowing,
                     "fertilizer": n_fert,
@@ -271,129 +430,427 @@ def main():
         },
     }
 
-    def elevation_range(elevation):
-        if elevation < 1600:
-            return elevation_ranges["<1600"]
-        elif elevation <= 1900:
-            return elevation_ranges["=>1600&<=1900"]
-        else:
-            return elevation_ranges[">1900"]
-
-    def avg_static_elevation_onsets(elevation):
-        "return avg onsets for given elevation"
-        d = elevation_range(elevation)["onsets"]
+    def avg_static_elevation_onsets(elev_range):
+        "return avg onsets for given elevation range"
+        d = elev_range["onsets"]
         avg_doy = (d["from"].timetuple().tm_yday + d["to"].timetuple().tm_yday) // 2
         return (date(2017, 1, 1) + timedelta(days=avg_doy-1)).strftime("0000-%m-%d")
-    
 
+    def create_cultivation_method(variety, adaptation_option, elev_range):
+        """create the cultivation method for variety, adaptation option and elevation range
+        from copies of the templates, for calculated onsets the sowing date is left as placeholder"""
+        # set fertilization
+        fertilizations = []
+        if adaptation_option["fertilizer"] == "recommended":
+            fert = elev_range["fertilizer"]
+            fertilizations = copy.deepcopy(templates["mineral-fertilization"])
+            fertilizations[0]["amount"][0] = float(fert["N"]) /2
+            fertilizations[1]["amount"][0] = float(fert["N"]) /2
+        elif "NDemand" in adaptation_option["fertilizer"]:
+            #this strategy should be used to design adaptation options
+            Ndem = float(adaptation_option["fertilizer"].split("_")[1])
+            fertilizations = copy.deepcopy(templates["NDemand-fertilization"])
+            fertilizations[0]["N-demand"][0] = Ndem
+            fertilizations[1]["N-demand"][0] = Ndem
+        elif "targetN" in adaptation_option["fertilizer"]:
+            target_Ndem = elev_range["target_soilN"]
+            fertilizations = copy.deepcopy(templates["NDemand-fertilization"])
+            fertilizations[0]["N-demand"][0] = target_Ndem
+            fertilizations[1]["N-demand"][0] = target_Ndem
+
+        # set cycle length
+        if adaptation_option["cycle-length"] == "standard":
+            print "cycle length standard: to be done"
+        elif adaptation_option["cycle-length"] == "longer":
+            print "cycle length longer: to be done"
+
+        # insert sowing
+        if adaptation_option["sowing"] == "recommended/avg-static-elevation-onsets":
+            sowing = dict(templates["static-sowing"])
+            sowing["date"] = avg_static_elevation_onsets(elev_range)
+
+        elif adaptation_option["sowing"] == "recommended/dynamic-elevation-onsets":
+            sowing = dict(templates["automatic-sowing"])
+            dates = elev_range["onsets"]
+            sowing["earliest-date"] = dates["from"].strftime("0000-%m-%d")
+            sowing["latest-date"] = dates["to"].strftime("0000-%m-%d")
+
+        elif adaptation_option["sowing"] == "calculated-onsets":
+            sowing = dict(templates["static-sowing"])
+            sowing["date"] = env_builder.placeholder("sowing-date")
+
+        sowing["crop"] = templates[variety]
+        cultivation_method = dict(templates["cultivation-method"])
+        cultivation_method["worksteps"] = [sowing] + fertilizations + [templates["automatic-harvest"]]
+        return cultivation_method
+
+    climate_mode = config["climate"]
+    if climate_mode not in ["path", "inline", "node-cache"]:
+        raise ValueError("climate has to be path, inline or node-cache, not " + climate_mode)
+    builder = env_builder.EnvBuilder(env, inline_climate=climate_mode == "inline")
+
+    space = job_space.JobSpace(rcps, adaptation_options, sorghum_varieties, len(site_table))
+    space.filter_scenarios(rcps=job_space.parse_list(config["rcps"]), sowings=job_space.parse_list(config["sowings"]),
+                           fertilizers=job_space.parse_list(config["fertilizers"]),
+                           cycle_lengths=job_space.parse_list(config["cycle-lengths"]),
+                           varieties=job_space.parse_list(config["varieties"]))
+    site_lats = site_table["lat"]
+    site_lons = site_table["lon"]
+    if config["bbox"]:
+        space.filter_sites(job_space.is_in_bbox(site_lats, site_lons, job_space.parse_bbox(config["bbox"])))
+    if config["region"]:
+        space.filter_sites(job_space.is_in_polygon(site_lats, site_lons, job_space.read_polygon(config["region"])))
+    if config["bands"]:
+        space.filter_sites(np.in1d(site_table["band"], map(int, config["bands"].split(","))))
+    if float(config["sample"]) < 1:
+        space.filter_sites(job_space.sample_sites(space.selected_sites, site_table["band"], float(config["sample"]),
+                                                  int(config["seed"]), stratified=config["sample-mode"] == "stratified"))
+
+    def find_duplicate_sites(lat_tolerance):
+        """return the index of the representative of each selected site, the first of the sites with identical inputs,
+        {representative: [(lat, lon, elevation, site index) of the other sites]} and {representative: content hash}"""
+        representatives = np.arange(len(site_table))
+        duplicates = defaultdict(list)
+        hashes = {}
+        key_to_representative = {}
+        for site_index in np.flatnonzero(space.selected_sites).tolist():
+            site = site_table[site_index]
+            lat = float(site["lat"])
+            lon = float(site["lon"])
+            # these are all the site's inputs of an env
+            key = env_builder.dumps([soil.profile(lat, lon), round(lat / lat_tolerance) if lat_tolerance > 0 else lat,
+                                     float(site["slope"]), float(site["elevation"]), float(site["clat"]), float(site["clon"])])
+            representative = key_to_representative.setdefault(key, site_index)
+            representatives[site_index] = representative
+            if representative == site_index:
+                hashes[site_index] = hashlib.sha1(key).hexdigest()
+            else:
+                duplicates[representative].append((lat, lon, float(site["elevation"]), site_index))
+        return representatives, duplicates, hashes
+
+    dedup = config["dedup"] == "true"
+    if dedup:
+        site_representatives, site_duplicates, site_hashes = find_duplicate_sites(float(config["dedup-lat-tolerance"]))
+        print np.count_nonzero(space.selected_sites) - len(site_hashes), "of", np.count_nonzero(space.selected_sites), \
+        "sites have the same inputs as another site"
+        is_simulated = site_representatives == np.arange(len(site_table))
+    else:
+        is_simulated = np.ones(len(site_table), dtype=bool)
+
+    def hash_job_space():
+        "return a hash of the jobs and their ids, the same for every shard and worker"
+        sha1 = hashlib.sha1(json.dumps([space.scenarios, space.selected_scenarios], sort_keys=True))
+        for values in [site_lats, site_lons, space.selected_sites, is_simulated]:
+            sha1.update(np.ascontiguousarray(values).tobytes())
+        return sha1.hexdigest()[:16]
+
+    job_space_hash = hash_job_space()
+    run_id = config["run-id"]
+    if not run_id and config["resume"] == "true":
+        run_id = jobs_io.read_newest_run_id(paths["local-path-to-output-dir"])
+    if not run_id and config["new-run"] == "true":
+        # the results of an earlier run of the job space don't count as done in it
+        run_id = job_space_hash + "-" + time.strftime("%Y%m%d-%H%M%S", time.localtime(start_prep))
+    if not run_id:
+        run_id = job_space_hash
+
+    # counted without generating the jobs
+    shard_job_counts = space.count(shard, shard_count, sites=is_simulated)
+    print sum(space.count().itervalues()), "jobs match the filters,", sum(shard_job_counts.itervalues()), \
+    "of them to be sent by shard", config["shard"], "(" + ", ".join(rcp + ": " + str(shard_job_counts[rcp])
+                                                             for rcp in rcps if rcp in shard_job_counts) + ")"
+    if config["count-only"] == "true":
+        return
+
+    if config["resume"] != "true" and config["remove-stale-manifests"] == "true":
+        # the manifests of an earlier run of another job space in the same output dir are stale,
+        # removed before any worker process starts writing its manifest,
+        # the ones of shards started separately (still being written or since this producer started) are kept
+        for filename in jobs_io.remove_manifests_of_other_runs(paths["local-path-to-output-dir"], run_id,
+                                                               before=start_prep, job_space=None
+                                                               if config["new-run"] == "true" else job_space_hash):
+            print "removed manifest", filename, "of an earlier run"
+    print "run", run_id
+
+    if workers > 1:
+        # the inputs are cached now, so the worker processes can start sending right away
+        run_worker_processes(shard, shard_count, workers, ["run-id=" + run_id, "remove-stale-manifests=false"])
+        return
+
+    path_to_manifest = jobs_io.path_to_manifest(paths["local-path-to-output-dir"], shard, shard_count)
+    done_job_ids = set()
+    prev_manifest = {}
+    if config["resume"] == "true":
+        # of the resumed run only, a ledger of another run is started again by the consumer
+        done_job_ids = jobs_io.read_ledger(jobs_io.path_to_ledger(paths["local-path-to-output-dir"]), run_id=run_id)
+        # of all shards, as the resumed run may have been split differently (e.g. another number of workers),
+        # the unfinished manifests of an interrupted run included
+        prev_manifest = jobs_io.read_manifests(paths["local-path-to-output-dir"], include_partial=True, run_id=run_id)
+        print "resuming shard", config["shard"], "with", len(done_job_ids), "jobs already done"
+    manifest = jobs_io.ManifestWriter(path_to_manifest, header=jobs_io.manifest_header(run_id, job_space_hash))
+    if dedup:
+        duplicates_writer = jobs_io.ManifestWriter(jobs_io.path_to_duplicates(paths["local-path-to-output-dir"],
+                                                                              shard, shard_count), header=["hash", "customId"])
+
+    wire = wire_format.WireFormat(config["wire-codec"],
+                                  dictionary=wire_format.read_dictionary(config["wire-dictionary"])
+                                  if config["wire-dictionary"] else None,
+                                  level=int(config["wire-level"]) if config["wire-level"] else None)
 
-    start_send = time.clock()
-    sent_env_count = 0
+    context = zmq.Context()
+    socket = context.socket(zmq.PUSH)
+    if config["send-hwm"]:
+        socket.setsockopt(zmq.SNDHWM, int(config["send-hwm"]))
+    socket.connect("tcp://" + config["server"] + ":" + config["port"])
 
-    for rcp in rcps:
-
-        onsets = read_onset_dates(paths["local-path-to-archive"] + "onset-dates/" + rcp + ".csv")
-
-        for adaptation_option in adaptation_options:
-            
-            for variety in sorghum_varieties:
-
-                for (lat, lon), profile in profiles.iteritems():
-
-                    sr, sh = transform(wgs84, utm37n, lon, lat)
-                    prob = interpol_crop_prob(sr, sh)
-                    if prob < 40:
-                        continue
-
-                    (clat, clon) = interpol_climate(sr, sh)
-                    slope = interpol_slope(sr, sh)
-                    elevation = interpol_elevation(sr, sh)
-
-                    env["params"]["siteParameters"]["SoilProfileParameters"] = profile
-                    env["params"]["siteParameters"]["Latitude"] = lat
-                    env["params"]["siteParameters"]["Slope"] = slope
-                    env["params"]["siteParameters"]["HeightNN"] = elevation
-
-                    # set fertilization
-                    fertilizations = []
-                    if adaptation_option["fertilizer"] == "recommended":
-                        fert = elevation_range(elevation)["fertilizer"]
-                        templates["mineral-fertilization"][0]["amount"][0] = float(fert["N"]) /2
-                        templates["mineral-fertilization"][1]["amount"][0] = float(fert["N"]) /2
-                        fertilizations = templates["mineral-fertilization"]
-                    elif "NDemand" in adaptation_option["fertilizer"]:
-                        #this strategy should be used to design adaptation options
-                        Ndem = float(adaptation_option["fertilizer"].split("_")[1])
-                        templates["NDemand-fertilization"][0]["N-demand"][0] = Ndem
-                        templates["NDemand-fertilization"][1]["N-demand"][0] = Ndem
-                        fertilizations = templates["NDemand-fertilization"]
-                    elif "targetN" in adaptation_option["fertilizer"]:
-                        target_Ndem = elevation_range(elevation)["target_soilN"]
-                        templates["NDemand-fertilization"][0]["N-demand"][0] = target_Ndem
-                        templates["NDemand-fertilization"][1]["N-demand"][0] = target_Ndem
-                        fertilizations = templates["NDemand-fertilization"]
-
-                    # set cycle length
-                    if adaptation_option["cycle-length"] == "standard":
-                        print "cycle length standard: to be done"
-                    elif adaptation_option["plant-density"] == "increased":
-                        print "cycle length increased: to be done"
-
-                    # insert static sowing
-                    if adaptation_option["sowing"] == "recommended/avg-static-elevation-onsets":
-                        templates["static-sowing"]["crop"] = templates[variety]
-                        templates["static-sowing"]["date"] = avg_static_elevation_onsets(elevation)
-                        templates["cultivation-method"]["worksteps"] = [templates["static-sowing"]] + fertilizations + [templates["automatic-harvest"]]
-                        env["cropRotation"] = [templates["cultivation-method"]]
-
-                    elif adaptation_option["sowing"] == "recommended/dynamic-elevation-onsets":
-                        templates["automatic-sowing"]["crop"] = templates[variety]
-                        dates = elevation_range(elevation)["onsets"]
-                        templates["automatic-sowing"]["earliest-date"] = dates["from"].strftime("0000-%m-%d")
-                        templates["automatic-sowing"]["latest-date"] = dates["to"].strftime("0000-%m-%d")
-                        templates["cultivation-method"]["worksteps"] = [templates["automatic-sowing"]] + fertilizations + [templates["automatic-harvest"]]
-                        env["cropRotation"] = [templates["cultivation-method"]]
-
-                    elif adaptation_option["sowing"] == "calculated-onsets":
-                        year_to_onset = onsets[(clat, clon)]
-                        templates["static-sowing"]["crop"] = templates[variety]
-                        templates["cultivation-method"]["worksteps"] = [templates["static-sowing"]] + fertilizations + [templates["automatic-harvest"]]
-                        env["cropRotation"] = []
-                        for year in sorted(year_to_onset.keys()):
-                            cm = copy.deepcopy(templates["cultivation-method"])
-                            onset_date = (date(2017, 1, 1) + timedelta(days=year_to_onset[year]-1)).strftime("0000-%m-%d")
-                            cm["worksteps"][0]["date"] = onset_date
-                            env["cropRotation"].append(cm)
-
-                    
-
-                    #set climate file - read by the server
-                    env["csvViaHeaderOptions"] = sim["climate.csv-options"]
-                    if rcp == "baseline":
-                        env["csvViaHeaderOptions"]["start-date"] = "1972-01-01"
-                        env["csvViaHeaderOptions"]["end-date"] = "1999-12-31"
-                    else:
-                        env["csvViaHeaderOptions"]["start-date"] = "2011-01-01"
-                        env["csvViaHeaderOptions"]["end-date"] = "2098-12-31"
-                    env["pathToClimateCSV"] = paths["local-path-to-archive" if use_local_paths else "cluster-path-to-archive"] \
-                    + "climate/ipsl-cm5a-lr/" + rcp + "/" + rcp + "_" + str(clat) + "_" + str(clon) + ".csv"
-
-                    env["customId"] = \
-                    variety \
-                    + "|" + str(lat) \
-                    + "|" + str(lon) \
-                    + "|" + str(rcp) \
-                    + "|" + adaptation_option["sowing"] \
-                    + "|" + adaptation_option["fertilizer"] \
-                    + "|" + adaptation_option["cycle-length"] \
-                    + "|" + str(elevation) \
-
-                    socket.send_json(env) 
-                    print "sent env ", sent_env_count, " customId: ", env["customId"]
-                    sent_env_count += 1
-
-    print "sending", sent_env_count, "envs took", (time.clock() - start_send), "seconds"
+    if int(config["max-in-flight"]) > 0 and not config["ack-server"]:
+        print "max-in-flight needs the consumer's acknowledgements from ack-server, sending without limit"
+    if float(config["redispatch-factor"]) > 0 and not config["ack-server"]:
+        print "redispatch-factor needs the consumer's acknowledgements from ack-server, not redispatching"
+    flow = flow_control.FlowControl(context, ack_server=config["ack-server"], max_in_flight=int(config["max-in-flight"]),
+                                    max_rate=float(config["max-rate"]), ack_timeout=float(config["ack-timeout"]),
+                                    redispatch_factor=float(config["redispatch-factor"]),
+                                    min_deadline=float(config["redispatch-min-seconds"]),
+                                    max_redispatches=int(config["max-redispatches"]), resend=socket.send)
+
+    # the simulated jobs of this shard minus the ones already done
+    selected_scenarios = set(space.selected_scenarios)
+    sent_envs["total"] = sum(shard_job_counts.itervalues()) \
+    - sum(1 for job_id in done_job_ids if job_id % shard_count == shard and job_id // len(site_table) in selected_scenarios
+          and space.selected_sites[job_id % len(site_table)] and is_simulated[job_id % len(site_table)])
+
+    def create_custom_id(variety, lat, lon, rcp, adaptation_option, elevation, job_id):
+        return variety \
+        + "|" + str(lat) \
+        + "|" + str(lon) \
+        + "|" + str(rcp) \
+        + "|" + adaptation_option["sowing"] \
+        + "|" + adaptation_option["fertilizer"] \
+        + "|" + adaptation_option["cycle-length"] \
+        + "|" + str(elevation) \
+        + "|" + str(job_id)
+
+    rcp_data = {}
+
+    def read_rcp_data(rcp):
+        "return the onsets, climate period, encoded csv options and climate cube of rcp, read only once"
+        data = rcp_data.get(rcp)
+        if data is None:
+            onsets = inputs.get("onsets-" + rcp) or load_onset_dates(rcp)
+
+            #set climate file - read by the server
+            csv_options = dict(sim["climate.csv-options"])
+            if rcp == "baseline":
+                csv_options["start-date"] = "1972-01-01"
+                csv_options["end-date"] = "1999-12-31"
+            else:
+                csv_options["start-date"] = "2011-01-01"
+                csv_options["end-date"] = "2098-12-31"
+
+            first_year, last_year = int(csv_options["start-date"][:4]), int(csv_options["end-date"][:4])
+            data = rcp_data[rcp] = {
+                "onsets": onsets,
+                "onset-cell-to-index": {(clat, clon): cell_index
+                                        for cell_index, (clat, clon) in enumerate(onsets["cells"].tolist())},
+                # number of years with an onset by climate cell
+                "onset-years": (onsets["doys"] >= 0).sum(axis=1).tolist(),
+                "climate-period": (csv_options["start-date"], csv_options["end-date"]),
+                "years": last_year - first_year + 1,
+                "csv-options": env_builder.Encoded(env_builder.dumps(csv_options)),
+                "cube": climate_cube.ClimateCube(config["path-to-climate-cubes"], rcp) if climate_mode == "inline" else None
+            }
+        return data
+
+    def cost_features(rcp, adaptation_option, clat, clon):
+        """return the simulated years and the years with their own cultivation method of a job (see job_costs),
+        also written to the manifest for the consumer to record the job's costs with"""
+        data = read_rcp_data(rcp)
+        rotation_years = 0
+        if adaptation_option["sowing"] == "calculated-onsets":
+            # a cultivation method for every year with an onset in the site's climate cell
+            cell_index = data["onset-cell-to-index"].get((clat, clon))
+            rotation_years = data["onset-years"][cell_index] if cell_index is not None else 0
+        return data["years"], rotation_years
+
+    def estimate_costs(coefficients):
+        "return a function estimating the costs of the jobs of a scenario at an array of site indices"
+        def costs(scenario_index, site_indices):
+            rcp, adaptation_option, _ = space.scenarios[scenario_index]
+            features = np.array([cost_features(rcp, adaptation_option, clat, clon)
+                                 for clat, clon in zip(site_table["clat"][site_indices].tolist(),
+                                                       site_table["clon"][site_indices].tolist())]).reshape(-1, 2)
+            return job_costs.estimate(coefficients, features[:, 0], features[:, 1])
+        return costs
+
+    costs = None
+    if config["order"] == "cost":
+        path_to_cost_history = config["cost-history"] or job_costs.path_to_cost_history(paths["local-path-to-output-dir"])
+        coefficients = job_costs.fit_coefficients(path_to_cost_history)
+        if coefficients is None:
+            print "not enough job costs recorded in", path_to_cost_history, "estimating them from the simulated years"
+            coefficients = job_costs.DEFAULT_COEFFICIENTS
+        print "estimating job costs as", " + ".join(str(round(coefficient, 4)) + " * " + feature
+                                                    for coefficient, feature in zip(coefficients, job_costs.FEATURES))
+        costs = estimate_costs(coefficients)
+    elif config["order"] != "loop":
+        raise ValueError("order has to be loop or cost, not " + config["order"])
+
+    # the encoded calculated-onsets rotations of the most recently used (rcp, cultivation method, climate cell)s
+    rotations = OrderedDict()
+    rotation_cache_size = int(config["rotation-cache-size"])
+    # the encoded climate csvs of the most recently used (rcp, climate cell)s
+    climate_csvs = OrderedDict()
+    climate_cache_size = int(config["climate-cache-size"])
+
+    start_send = time.time()
+    sent_env_count = 0
+    skipped_env_count = 0
+    deduplicated_env_count = 0
+
+    for job_id, rcp, adaptation_option, variety, site_index in space.jobs(shard, shard_count, costs=costs):
+
+        data = read_rcp_data(rcp)
+        site = site_table[site_index]
+        # job id of the first site of the job's scenario
+        job_index = job_id - site_index
+
+        lat = float(site["lat"])
+        lon = float(site["lon"])
+        clat = float(site["clat"])
+        clon = float(site["clon"])
+        slope = float(site["slope"])
+        elevation = float(site["elevation"])
+        band = results_io.ELEVATION_BANDS[site["band"]]
+
+        custom_id = create_custom_id(variety, lat, lon, rcp, adaptation_option, elevation, job_id)
+        years, rotation_years = cost_features(rcp, adaptation_option, clat, clon)
+
+        if dedup:
+            if not is_simulated[site_index]:
+                # the job's result comes with its representative's
+                manifest.write(job_id, custom_id, years, rotation_years)
+                deduplicated_env_count += 1
+                continue
+
+            duplicates = [(dlat, dlon, delevation, job_index + dsite_index)
+                          for dlat, dlon, delevation, dsite_index in site_duplicates.get(site_index, [])]
+            if duplicates:
+                env_hash = hashlib.sha1(site_hashes[site_index] + "|" + "|".join(custom_id.split("|")[3:7]) \
+                                        + "|" + variety).hexdigest()
+                duplicates_writer.write(env_hash, custom_id)
+                for dlat, dlon, delevation, djob_id in duplicates:
+                    duplicates_writer.write(env_hash, create_custom_id(variety, dlat, dlon, rcp, adaptation_option,
+                                                                       delevation, djob_id))
+                custom_id += "|" + jobs_io.encode_duplicates(duplicates)
+
+        manifest.write(job_id, custom_id, years, rotation_years)
+        if job_id in done_job_ids:
+            # a job may be missing from the previous manifests, e.g. if their end was lost in a crash
+            if job_id in prev_manifest and prev_manifest[job_id] != custom_id:
+                raise Exception("job " + str(job_id) + " is now " + custom_id + " but was " \
+                + str(prev_manifest.get(job_id)) + ", the job space changed since the resumed run")
+            skipped_env_count += 1
+            continue
+
+        start_build = time.time()
+        template_key = (variety, adaptation_option["sowing"], adaptation_option["fertilizer"], 
+                        adaptation_option["cycle-length"], band)
+        cultivation_method = builder.template(template_key,
+            lambda: create_cultivation_method(variety, adaptation_option, elevation_ranges[band]))
+
+        if adaptation_option["sowing"] == "calculated-onsets":
+            # all sites in the same climate cell get the same rotation
+            rotation_key = (rcp, template_key, clat, clon)
+            crop_rotation = rotations.pop(rotation_key, None)
+            if crop_rotation is None:
+                cell_index = data["onset-cell-to-index"].get((clat, clon))
+                doys = data["onsets"]["doys"][cell_index].tolist() if cell_index is not None else []
+                crop_rotation = env_builder.encode_list(
+                    cultivation_method.encode({"sowing-date": SOWING_DATES[doy]}) for doy in doys if doy >= 0)
+                if len(rotations) >= rotation_cache_size:
+                    rotations.popitem(last=False)
+            rotations[rotation_key] = crop_rotation
+        else:
+            crop_rotation = env_builder.encode_list([cultivation_method.encode({})])
+        start_serialization = time.time()
+        metrics.add_stage_time("env-build", start_serialization - start_build)
+
+        climate_filename = rcp + "_" + str(clat) + "_" + str(clon) + ".csv"
+        values = {
+            "soil-profile": soil.profile(lat, lon),
+            "latitude": lat,
+            "slope": slope,
+            "height": elevation,
+            "crop-rotation": crop_rotation,
+            "csv-options": data["csv-options"],
+            "path-to-climate-csv": paths["local-path-to-archive" if use_local_paths else "cluster-path-to-archive"] \
+            + "climate/ipsl-cm5a-lr/" + rcp + "/" + climate_filename,
+            "custom-id": custom_id
+        }
+        if climate_mode == "inline":
+            climate_csv = climate_csvs.pop((rcp, clat, clon), None)
+            if climate_csv is None:
+                climate_csv = env_builder.Encoded(env_builder.dumps(data["cube"].csv(clat, clon,
+                                                                                     *data["climate-period"])))
+                if len(climate_csvs) >= climate_cache_size:
+                    climate_csvs.popitem(last=False)
+            climate_csvs[(rcp, clat, clon)] = climate_csv
+            values["climate-csv"] = climate_csv
+            values["path-to-climate-csv"] = ""
+        elif climate_mode == "node-cache":
+            values["path-to-climate-csv"] = config["node-cache-dir"] + rcp + "/" + climate_filename
+
+        env_msg = builder.build(values)
+        if wire.codec:
+            start_compression = time.time()
+            metrics.add_stage_time("serialization", start_compression - start_serialization)
+            env_msg = wire.encode(env_msg)
+            start_flow_control = time.time()
+            metrics.add_stage_time("compression", start_flow_control - start_compression)
+        else:
+            start_flow_control = time.time()
+            metrics.add_stage_time("serialization", start_flow_control - start_serialization)
+
+        # the job is known by its manifest before its result can be in the consumer's ledger
+        manifest.flush()
+        flow.wait_for_slot()
+        start_send_env = time.time()
+        metrics.add_stage_time("flow-control", start_send_env - start_flow_control)
+
+        socket.send(env_msg)
+        metrics.add_stage_time("send", time.time() - start_send_env)
+        flow.sent(job_id, env_msg)
+        if flow.max_in_flight > 0:
+            metrics.set_gauge("in-flight", flow.in_flight())
+        metrics.count_message(len(env_msg))
+        if verbose:
+            print "sent env ", sent_env_count, " customId: ", custom_id
+        sent_env_count += 1
+
+    manifest.close()
+    if dedup:
+        duplicates_writer.close()
+    with metrics.stage("drain"):
+        flow.drain()
+    flow.close()
+    metrics.report()
+    print "shard", config["shard"], "sending", sent_env_count, "envs took", (time.time() - start_send), "seconds"
+    if skipped_env_count > 0:
+        print "skipped", skipped_env_count, "envs already done"
+    if deduplicated_env_count > 0:
+        print "didn't send", deduplicated_env_count, "envs identical to another one"
+    if flow.redispatched:
+        print "redispatched", len(flow.redispatched), "jobs", sum(flow.redispatched.itervalues()), "times:", \
+        " ".join(map(str, sorted(flow.redispatched)))
+    if flow.lost:
+        print "gave up on", len(flow.lost), "jobs:", " ".join(map(str, sorted(flow.lost)))
+    metrics.write_json(run_metrics.path_to_metrics(paths["local-path-to-output-dir"], 
+                                                   "producer-shard-" + str(shard) + "-of-" + str(shard_count)),
+                       shard=config["shard"], skipped=skipped_env_count, deduplicated=deduplicated_env_count,
+                       redispatches=sum(flow.redispatched.itervalues()), redispatched=sorted(flow.redispatched),
+                       lost=sorted(flow.lost))
     
 
-main()
+if __name__ == "__main__":
+    main()
 
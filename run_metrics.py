@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+
+class _Stage(object):
+    "context manager adding the time spent in its block to a stage"
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, *_):
+        self._metrics.add_stage_time(self._name, time.time() - self._start)
+
+
+class RunMetrics(object):
+    """counts the messages and bytes sent or received, accumulates the time spent in named stages
+    and prints a progress line at most every report_interval seconds,
+    remaining is a function returning the number of outstanding messages (or None if unknown) for the ETA,
+    stage times may be added from several threads"""
+
+    def __init__(self, action, remaining=None, report_interval=10.0):
+        self.action = action
+        self.remaining = remaining
+        self.report_interval = report_interval
+        self.messages = 0
+        self.bytes = 0
+        self.stages = OrderedDict()
+        self.gauges = OrderedDict()
+        self._stages_lock = threading.Lock()
+        self._start = time.time()
+        self._last_report = (self._start, 0, 0)
+
+    def stage(self, name):
+        "return a context manager timing its block as stage name"
+        return _Stage(self, name)
+
+    def add_stage_time(self, name, seconds, count=1):
+        with self._stages_lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0.0, 0]
+            stage[0] += seconds
+            stage[1] += count
+
+    def set_gauge(self, name, value):
+        "set the current value of a gauge like the number of jobs in flight, its maximum is kept too"
+        gauge = self.gauges.get(name)
+        if gauge is None:
+            gauge = self.gauges[name] = [value, value]
+        gauge[0] = value
+        gauge[1] = max(gauge[1], value)
+
+    def count_message(self, size):
+        "count a message of size bytes and report the progress if it is due"
+        self.messages += 1
+        self.bytes += size
+        if time.time() - self._last_report[0] >= self.report_interval:
+            self.report()
+
+    def report(self):
+        "print the rates since the last report and the ETA at these rates"
+        now = time.time()
+        last_time, last_messages, last_bytes = self._last_report
+        seconds = max(now - last_time, 1e-9)
+        msgs_per_sec = (self.messages - last_messages) / seconds
+        line = self.action + " " + str(self.messages) + " msgs | " + str(round(msgs_per_sec, 1)) + " msgs/s | " \
+        + str(round((self.bytes - last_bytes) / seconds / 1e6, 2)) + " MB/s"
+        remaining = self.remaining() if self.remaining else None
+        if remaining is not None:
+            line += " | " + str(remaining) + " left | ETA " \
+            + (str(timedelta(seconds=int(remaining / msgs_per_sec))) if msgs_per_sec > 0 else "unknown")
+        for name, (value, _) in self.gauges.iteritems():
+            line += " | " + name + " " + str(value)
+        print line
+        self._last_report = (now, self.messages, self.bytes)
+
+    def summary(self):
+        "return the metrics as dict"
+        seconds = max(time.time() - self._start, 1e-9)
+        with self._stages_lock:
+            stages = OrderedDict((name, {"seconds": stage[0], "count": stage[1]})
+                                 for name, stage in self.stages.iteritems())
+        return OrderedDict([
+            ("action", self.action),
+            ("seconds", seconds),
+            ("messages", self.messages),
+            ("bytes", self.bytes),
+            ("msgs-per-sec", self.messages / seconds),
+            ("mb-per-sec", self.bytes / seconds / 1e6),
+            ("stages", stages),
+            ("gauges", OrderedDict((name, {"last": gauge[0], "max": gauge[1]})
+                                   for name, gauge in self.gauges.iteritems()))
+        ])
+
+    def write_json(self, path_to_json, **extra):
+        "write the summary and the extra values to path_to_json"
+        path_to_dir = os.path.dirname(path_to_json)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        summary = self.summary()
+        summary.update(extra)
+        with open(path_to_json, "w") as _:
+            json.dump(summary, _, indent=2)
+
+
+def path_to_metrics(path_to_out_dir, name):
+    "return the path to the metrics json of name in the output dir"
+    return path_to_out_dir + "metrics/" + name + ".json"
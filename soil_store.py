@@ -0,0 +1,112 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+
+# the parameters of a soil layer, in the order of the columns of soil.csv after lat and lon
+LAYER_FIELDS = ["Thickness", "Sand", "Clay", "pH", "FieldCapacity", "PermanentWiltingPoint",
+                "SoilBulkDensity", "SoilOrganicCarbon"]
+
+LAYER_DTYPE = np.dtype([(name, np.float64) for name in LAYER_FIELDS])
+
+
+def create_arrays(layers):
+    """create the arrays of a SoilStore from soil layer rows of (lat, lon, LAYER_FIELDS...),
+    the layers of a grid point keep the order of their rows"""
+    # lexsort is stable, so the layers of a grid point stay in order
+    layers = layers[np.lexsort((layers[:, 1], layers[:, 0]))]
+    is_first = np.ones(len(layers), dtype=bool)
+    is_first[1:] = (layers[1:, 0] != layers[:-1, 0]) | (layers[1:, 1] != layers[:-1, 1])
+    starts = np.flatnonzero(is_first)
+    ends = np.append(starts[1:], len(layers))
+
+    # identical profiles are stored once
+    profile_key_to_index = {}
+    profile_ranges = []
+    profiles = np.empty(len(starts), dtype=np.int32)
+    for site_index, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        key = layers[start:end, 2:].tobytes()
+        profile_index = profile_key_to_index.get(key)
+        if profile_index is None:
+            profile_index = profile_key_to_index[key] = len(profile_ranges)
+            profile_ranges.append((start, end))
+        profiles[site_index] = profile_index
+
+    counts = np.array([end - start for start, end in profile_ranges], dtype=np.int32)
+    offsets = np.zeros(len(counts), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)[:-1]
+    rows = np.concatenate([layers[start:end, 2:] for start, end in profile_ranges]) if profile_ranges \
+    else np.empty((0, len(LAYER_FIELDS)))
+    profile_layers = np.empty(len(rows), dtype=LAYER_DTYPE)
+    for column, name in enumerate(LAYER_FIELDS):
+        profile_layers[name] = rows[:, column]
+
+    return {"coords": layers[starts, :2].reshape(-1, 2), "profiles": profiles,
+            "offsets": offsets, "counts": counts, "layers": profile_layers}
+
+
+class SoilStore(object):
+    """the soil profiles of all grid points of the arrays created by create_arrays:
+    the grid points' (lat, lon) sorted in coords, the index of each grid point's profile in profiles
+    and the counts[profile] layers of a profile starting at offsets[profile] in the structured layers array,
+    the list of layer dicts MONICA expects is only created on request"""
+
+    def __init__(self, arrays):
+        self.coords = arrays["coords"]
+        self.profiles = arrays["profiles"]
+        self.offsets = arrays["offsets"]
+        self.counts = arrays["counts"]
+        self.layers = arrays["layers"]
+        self._lats = np.ascontiguousarray(self.coords[:, 0])
+        self._lons = np.ascontiguousarray(self.coords[:, 1])
+
+    def __len__(self):
+        "number of grid points"
+        return len(self.coords)
+
+    def profile_count(self):
+        "number of distinct profiles"
+        return len(self.counts)
+
+    def index(self, lat, lon):
+        "return the index of the grid point (lat, lon), a KeyError if there is none"
+        first = np.searchsorted(self._lats, lat, side="left")
+        end = np.searchsorted(self._lats, lat, side="right")
+        index = first + np.searchsorted(self._lons[first:end], lon)
+        if index >= end or self._lons[index] != lon:
+            raise KeyError((lat, lon))
+        return int(index)
+
+    def profile_index(self, lat, lon):
+        "return the index of the profile of the grid point (lat, lon), the same for identical profiles"
+        return int(self.profiles[self.index(lat, lon)])
+
+    def profile(self, lat, lon):
+        "return the profile of the grid point (lat, lon) as list of layer dicts"
+        profile_index = self.profile_index(lat, lon)
+        offset = self.offsets[profile_index]
+        # a dict display, its keys are dumped in the same order as ever
+        return [{
+            "Thickness": layer[0],
+            "Sand": layer[1],
+            "Clay": layer[2],
+            "pH": layer[3],
+            "FieldCapacity": layer[4],
+            "PermanentWiltingPoint": layer[5],
+            "SoilBulkDensity": layer[6],
+            "SoilOrganicCarbon": layer[7]
+        } for layer in self.layers[offset:offset + self.counts[profile_index]].tolist()]
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class SpatialIndex(object):
+    """nearest neighbour lookup for several gridded value layers,
+    layers on the same point set share a single KD-tree and are served by a single query"""
+
+    def __init__(self):
+        self._trees = []
+        self._layers = {}
+
+    def add_layer(self, name, points, values):
+        "add the values of a layer at the given (projected) points"
+        points = np.asarray(points, dtype=np.float64)
+        for tree_index, (tree_points, _) in enumerate(self._trees):
+            if tree_points.shape == points.shape and np.array_equal(tree_points, points):
+                break
+        else:
+            tree_index = len(self._trees)
+            self._trees.append((points, cKDTree(points)))
+
+        self._layers[name] = {
+            "tree": tree_index,
+            "values": np.asarray(values)
+        }
+
+    def query(self, points):
+        """return {layer name: values at the nearest data point} and
+        {layer name: distances to the nearest data point}, one tree query per distinct point set"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+        nearest = {}
+        for tree_index in set(layer["tree"] for layer in self._layers.itervalues()):
+            nearest[tree_index] = self._trees[tree_index][1].query(points)
+
+        values = {}
+        distances = {}
+        for name, layer in self._layers.iteritems():
+            distances[name], indices = nearest[layer["tree"]]
+            values[name] = layer["values"][indices]
+        return values, distances
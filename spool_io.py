@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import os
+import struct
+import time
+import zlib
+
+# every record of a spool file is the length of the compressed frame followed by the zlib compressed frame
+RECORD_HEADER = struct.Struct(">I")
+
+
+def _complete_size(spool_file):
+    "return the size of the complete records at the start of the open spool file"
+    spool_file.seek(0, os.SEEK_END)
+    size = spool_file.tell()
+    spool_file.seek(0)
+    position = 0
+    while position + RECORD_HEADER.size <= size:
+        length, = RECORD_HEADER.unpack(spool_file.read(RECORD_HEADER.size))
+        if position + RECORD_HEADER.size + length > size:
+            break
+        position += RECORD_HEADER.size + length
+        spool_file.seek(position)
+    return position
+
+
+class SpoolWriter(object):
+    """appends raw message frames to a spool file, compressed one by one,
+    a record cut off at the end of an existing spool (by an interrupted run) is removed first"""
+
+    def __init__(self, path_to_spool, compress_level=1, flush_interval=5.0):
+        path_to_dir = os.path.dirname(path_to_spool)
+        if path_to_dir and not os.path.isdir(path_to_dir):
+            os.makedirs(path_to_dir)
+        self.path_to_spool = path_to_spool
+        self.compress_level = compress_level
+        self.flush_interval = flush_interval
+        self.bytes = 0
+        self._file = open(path_to_spool, "ab+")
+        size = _complete_size(self._file)
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() > size:
+            print "removing", self._file.tell() - size, "bytes of a cut off record at the end of", path_to_spool
+            self._file.truncate(size)
+        self._last_flush = time.time()
+
+    def write(self, frame, compress_level=None):
+        "append frame, compressed with compress_level or the spool's level if None"
+        compressed = zlib.compress(frame, self.compress_level if compress_level is None else compress_level)
+        self._file.write(RECORD_HEADER.pack(len(compressed)))
+        self._file.write(compressed)
+        self.bytes += RECORD_HEADER.size + len(compressed)
+
+    def flush_if_due(self):
+        if time.time() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        "sync the written frames to disk"
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def read_frames(path_to_spool):
+    "generate the frames of a spool file in the order they were written, a cut off record at the end is skipped"
+    with open(path_to_spool, "rb") as _:
+        while True:
+            header = _.read(RECORD_HEADER.size)
+            if len(header) == 0:
+                break
+            length, = RECORD_HEADER.unpack(header) if len(header) == RECORD_HEADER.size else (None,)
+            compressed = _.read(length) if length is not None else ""
+            if length is None or len(compressed) < length:
+                print "skipping the cut off record at the end of", path_to_spool
+                break
+            yield zlib.decompress(compressed)
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import sys
+
+import zmq
+
+import run_metrics
+import wire_format
+
+
+def open_socket(context, socket_type, endpoint):
+    "return a socket bound ('bind:<port>') or connected ('connect:<host>:<port>') to endpoint"
+    how, _, address = endpoint.partition(":")
+    socket = context.socket(socket_type)
+    if how == "bind":
+        socket.bind("tcp://*:" + address)
+    elif how == "connect":
+        socket.connect("tcp://" + address)
+    else:
+        raise ValueError("endpoint has to be bind:<port> or connect:<host>:<port>, not " + endpoint)
+    return socket
+
+
+def main():
+    """relay messages between the producer/consumer and MONICA workers which only speak plain JSON,
+    mode=decode: pass on compressed messages (e.g. the producer's envs) as plain JSON,
+    mode=encode: pass on plain messages (e.g. the workers' results) compressed with wire-codec and wire-dictionary"""
+
+    config = {
+        "mode": "decode",
+        "in": "bind:6666", # the PULL side, bind:<port> or connect:<host>:<port>
+        "out": "connect:localhost:6667", # the PUSH side
+        "wire-codec": "zlib",
+        "wire-dictionary": "", # encode with this dictionary
+        "wire-dictionaries": "", # comma separated dictionaries to decode with
+        "wire-level": ""
+    }
+    if len(sys.argv) > 1:
+        for arg in sys.argv[1:]:
+            k,v = arg.split("=")
+            if k in config:
+                config[k] = v
+
+    if config["mode"] == "encode":
+        dictionary = wire_format.read_dictionary(config["wire-dictionary"]) if config["wire-dictionary"] else None
+        wire = wire_format.WireFormat(config["wire-codec"], dictionary=dictionary,
+                                      level=int(config["wire-level"]) if config["wire-level"] else None)
+        translate = wire.encode
+    elif config["mode"] == "decode":
+        wire = wire_format.WireFormat(dictionaries=[wire_format.read_dictionary(path)
+                                                    for path in config["wire-dictionaries"].split(",") if path])
+        translate = wire.decode
+    else:
+        raise ValueError("mode has to be decode or encode, not " + config["mode"])
+
+    context = zmq.Context()
+    in_socket = open_socket(context, zmq.PULL, config["in"])
+    out_socket = open_socket(context, zmq.PUSH, config["out"])
+
+    metrics = run_metrics.RunMetrics("relayed")
+    try:
+        while True:
+            msg = in_socket.recv()
+            out_msg = translate(msg)
+            out_socket.send(out_msg)
+            metrics.count_message(len(msg))
+    except KeyboardInterrupt:
+        pass
+
+    metrics.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+# -*- coding: UTF-8
+
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/. */
+
+# Authors:
+# Michael Berg-Mohnicke <michael.berg@zalf.de>
+#
+# Maintainers:
+# Currently maintained by the authors.
+#
+# This file has been created at the Institute of
+# Landscape Systems Analysis at the ZALF.
+# Copyright (C: Leibniz Centre for Agricultural Landscape Research (ZALF)
+
+import struct
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# compressed messages start with MAGIC (never the start of a JSON message), the codec and the dictionary id
+MAGIC = "\x00MW"
+HEADER = struct.Struct(">3scI")
+
+CODECS = {"zlib": "z", "zstd": "s"}
+
+DEFAULT_LEVELS = {"zlib": 1, "zstd": 3}
+
+# zlib only looks back this far, so a longer dictionary is of no use
+ZLIB_WINDOW = 32768
+
+
+def read_dictionary(path_to_dictionary):
+    with open(path_to_dictionary, "rb") as _:
+        return _.read()
+
+
+def dictionary_id(dictionary):
+    "return the id of a dictionary, 0 for no dictionary"
+    return zlib.crc32(dictionary) & 0xffffffff if dictionary else 0
+
+
+def is_compressed(frame):
+    return frame[:len(MAGIC)] == MAGIC
+
+
+class _ZlibCodec(object):
+    """zlib with a preset dictionary, which python 2's zlib doesn't support directly:
+    the dictionary is compressed first and every message continues from a copy of that state"""
+
+    def __init__(self, dictionary, level):
+        self._compressor = zlib.compressobj(level)
+        self._decompressor = zlib.decompressobj()
+        if dictionary:
+            dictionary = dictionary[-ZLIB_WINDOW:]
+            self._decompressor.decompress(self._compressor.compress(dictionary)
+                                          + self._compressor.flush(zlib.Z_SYNC_FLUSH))
+
+    def compress(self, msg):
+        compressor = self._compressor.copy()
+        return compressor.compress(msg) + compressor.flush()
+
+    def decompress(self, payload):
+        return self._decompressor.copy().decompress(payload)
+
+
+class _ZstdCodec(object):
+
+    def __init__(self, dictionary, level):
+        if zstandard is None:
+            raise Exception("the zstd codec needs the zstandard package")
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        self._compressor = zstandard.ZstdCompressor(level=level, dict_data=dict_data)
+        self._decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+
+    def compress(self, msg):
+        return self._compressor.compress(msg)
+
+    def decompress(self, payload):
+        return self._decompressor.decompress(payload)
+
+
+class WireFormat(object):
+    """encodes messages with codec (zlib, zstd or empty for plain JSON) and the dictionary,
+    decodes plain messages and messages compressed with any codec and one of the dictionaries"""
+
+    def __init__(self, codec="", dictionary=None, dictionaries=[], level=None):
+        if codec and codec not in CODECS:
+            raise ValueError("codec has to be one of " + ", ".join(sorted(CODECS)) + ", not " + codec)
+        self.codec = codec
+        self._dictionaries = {0: None}
+        for other_dictionary in dictionaries + [dictionary]:
+            self.add_dictionary(other_dictionary)
+        # (codec char, dictionary id) -> codec, created on first use
+        self._codecs = {}
+        self._levels = {CODECS[codec]: level} if codec and level is not None else {}
+        if codec:
+            self._header = HEADER.pack(MAGIC, CODECS[codec], dictionary_id(dictionary))
+            self._encoder = self._codec(CODECS[codec], dictionary_id(dictionary))
+
+    def add_dictionary(self, dictionary):
+        if dictionary:
+            self._dictionaries[dictionary_id(dictionary)] = dictionary
+
+    def _codec(self, codec_char, dict_id):
+        codec = self._codecs.get((codec_char, dict_id))
+        if codec is None:
+            if dict_id not in self._dictionaries:
+                raise Exception("message compressed with the unknown dictionary " + str(dict_id))
+            name = [name for name, char in CODECS.iteritems() if char == codec_char]
+            if not name:
+                raise Exception("message compressed with the unknown codec " + repr(codec_char))
+            level = self._levels.get(codec_char, DEFAULT_LEVELS[name[0]])
+            codec_class = _ZlibCodec if name[0] == "zlib" else _ZstdCodec
+            codec = self._codecs[(codec_char, dict_id)] = codec_class(self._dictionaries[dict_id], level)
+        return codec
+
+    def encode(self, msg):
+        "return msg compressed with the header, msg as is for plain JSON"
+        if not self.codec:
+            return msg
+        return self._header + self._encoder.compress(msg)
+
+    def decode(self, frame):
+        "return the plain message of a compressed or plain frame"
+        if not is_compressed(frame):
+            return frame
+        _, codec_char, dict_id = HEADER.unpack_from(frame)
+        return self._codec(codec_char, dict_id).decompress(frame[HEADER.size:])
+
+
+# decodes the messages received by this process (and the processes forked from it)
+_DECODER = WireFormat()
+
+
+def load_dictionaries(paths_to_dictionaries):
+    "let decode know the dictionaries in the files"
+    for path_to_dictionary in paths_to_dictionaries:
+        _DECODER.add_dictionary(read_dictionary(path_to_dictionary))
+
+
+def decode(frame):
+    "return the plain message of a compressed or plain frame, compressed with one of the loaded dictionaries"
+    return _DECODER.decode(frame)